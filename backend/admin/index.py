@@ -1,8 +1,38 @@
 import json
 import os
-import psycopg2
+import select
+import time
 from typing import Dict, Any
 
+CONN = None
+CONN_USED_AT = 0.0
+IDLE_CHECK_SECONDS = 30
+
+def get_connection():
+    """
+    Соединение с БД, переиспользуемое тёплыми вызовами функции.
+    Простаивающее соединение не должно получать данных: если сокет читается,
+    сервер или пулер уже закрыл его (перезапуск, таймаут простоя). После простоя
+    дольше IDLE_CHECK_SECONDS соединение дополнительно проверяется запросом SELECT 1.
+    """
+    global CONN, CONN_USED_AT
+    if CONN is not None and not CONN.closed:
+        try:
+            if select.select([CONN], [], [], 0)[0]:
+                raise ConnectionError('connection closed by server')
+            if time.monotonic() - CONN_USED_AT > IDLE_CHECK_SECONDS:
+                cur = CONN.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                CONN.rollback()
+        except Exception:
+            CONN.close()
+    if CONN is None or CONN.closed:
+        import psycopg2
+        CONN = psycopg2.connect(os.environ['DATABASE_URL'])
+    CONN_USED_AT = time.monotonic()
+    return CONN
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Админ-панель для просмотра логов и статистики
@@ -22,10 +52,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
+        if (event.get('queryStringParameters') or {}).get('action') == 'warmup':
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'warm': True}),
+                'isBase64Encoded': False
+            }
+        
         headers = event.get('headers', {})
         user_id = headers.get('x-user-id') or headers.get('X-User-Id')
         
@@ -92,11 +132,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 total_groups = cur.fetchone()[0]
                 
                 cur.execute("""
-                    SELECT u.username, u.name, COUNT(m.id) as message_count
-                    FROM users u
-                    LEFT JOIN messages m ON u.id = m.sender_id
-                    GROUP BY u.id, u.username, u.name
-                    ORDER BY message_count DESC
+                    SELECT u.username, u.name, c.messages_sent
+                    FROM user_counters c
+                    JOIN users u ON u.id = c.user_id
+                    ORDER BY c.messages_sent DESC
                     LIMIT 10
                 """)
                 top_users = cur.fetchall()
@@ -117,12 +156,16 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             elif action == 'user_activity':
                 target_user_id = params.get('user_id')
+                limit = min(int(params.get('limit', 50)), 200)
+                before_id = int(params['before_id']) if params.get('before_id') else None
+                days = min(int(params.get('days', 30)), 365)
                 
                 cur.execute("""
                     SELECT u.id, u.username, u.name, u.avatar, u.is_online,
-                           (SELECT COUNT(*) FROM messages WHERE sender_id = u.id) as messages_sent,
-                           (SELECT COUNT(*) FROM calls WHERE caller_id = u.id OR receiver_id = u.id) as calls_count
+                           COALESCE(c.messages_sent, 0), COALESCE(c.calls_made, 0), COALESCE(c.calls_received, 0),
+                           u.last_active_at
                     FROM users u
+                    LEFT JOIN user_counters c ON c.user_id = u.id
                     WHERE u.id = %s
                 """, (target_user_id,))
                 
@@ -136,14 +179,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     }
                 
                 cur.execute("""
-                    SELECT al.action, al.details, al.created_at
+                    SELECT day, messages, calls
+                    FROM user_activity_daily
+                    WHERE user_id = %s AND day > CURRENT_DATE - %s
+                    ORDER BY day
+                """, (target_user_id, days))
+                histogram = cur.fetchall()
+                
+                cur.execute("""
+                    SELECT al.id, al.action, al.details, al.created_at
                     FROM activity_logs al
-                    WHERE al.user_id = %s
-                    ORDER BY al.created_at DESC
-                    LIMIT 50
-                """, (target_user_id,))
+                    WHERE al.user_id = %s AND (%s IS NULL OR al.id < %s)
+                    ORDER BY al.id DESC
+                    LIMIT %s
+                """, (target_user_id, before_id, before_id, limit + 1))
                 
                 activity = cur.fetchall()
+                next_cursor = activity[limit - 1][0] if len(activity) > limit else None
                 
                 return {
                     'statusCode': 200,
@@ -156,9 +208,14 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                             'avatar': user_data[3],
                             'online': user_data[4],
                             'messagesSent': user_data[5],
-                            'callsCount': user_data[6]
+                            'callsCount': user_data[6] + user_data[7],
+                            'callsMade': user_data[6],
+                            'callsReceived': user_data[7],
+                            'lastActive': user_data[8].isoformat() if user_data[8] else None
                         },
-                        'activity': [{'action': a[0], 'details': a[1], 'time': a[2].isoformat()} for a in activity]
+                        'histogram': [{'day': h[0].isoformat(), 'messages': h[1], 'calls': h[2]} for h in histogram],
+                        'activity': [{'id': a[0], 'action': a[1], 'details': a[2], 'time': a[3].isoformat()} for a in activity[:limit]],
+                        'nextCursor': next_cursor
                     }),
                     'isBase64Encoded': False
                 }
@@ -172,4 +229,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
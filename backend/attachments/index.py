@@ -0,0 +1,625 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import re
+import select
+import time
+import uuid
+from typing import Dict, Any, Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote
+
+CHUNK_SIZE = 1024 * 1024
+MAX_ATTACHMENT_SIZE = 200 * 1024 * 1024
+MAX_DOWNLOAD_SIZE = 5 * 1024 * 1024
+
+class ChunkReader:
+    """
+    Файловый объект поверх последовательности чанков, чтобы не собирать файл в памяти
+    """
+    def __init__(self, chunks: Iterable[bytes]):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+class LocalStorage:
+    """
+    Хранилище на локальной файловой системе (для разработки и тестов)
+    """
+    def __init__(self, root: str, public_url: Optional[str] = None):
+        self.root = root
+        self.public_url = public_url
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key: str, data: bytes) -> None:
+        self.put_stream(key, [data])
+
+    def put_stream(self, key: str, chunks: Iterable[bytes]) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> bytes:
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def get_range(self, key: str, start: int, length: int) -> bytes:
+        with open(self.path(key), 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def url(self, key: str) -> Optional[str]:
+        return f'{self.public_url}/{key}' if self.public_url else None
+
+class S3Storage:
+    """
+    S3-совместимое хранилище
+    """
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, public_url: Optional[str] = None):
+        import boto3
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.public_url = public_url
+
+    def put(self, key: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    def put_stream(self, key: str, chunks: Iterable[bytes]) -> None:
+        self.client.upload_fileobj(ChunkReader(chunks), self.bucket, key)
+
+    def get(self, key: str) -> bytes:
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def get_range(self, key: str, start: int, length: int) -> bytes:
+        byte_range = f'bytes={start}-{start + length - 1}'
+        return self.client.get_object(Bucket=self.bucket, Key=key, Range=byte_range)['Body'].read()
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def url(self, key: str) -> Optional[str]:
+        return f'{self.public_url}/{key}' if self.public_url else None
+
+STORAGE = None
+
+def get_storage():
+    global STORAGE
+    if STORAGE is None:
+        if os.environ.get('S3_BUCKET'):
+            STORAGE = S3Storage(os.environ['S3_BUCKET'], os.environ.get('S3_ENDPOINT_URL'),
+                                os.environ.get('S3_PUBLIC_URL'))
+        else:
+            STORAGE = LocalStorage(os.environ.get('ATTACHMENTS_DIR', '/tmp/attachments'),
+                                   os.environ.get('ATTACHMENTS_PUBLIC_URL'))
+    return STORAGE
+
+def chunk_key(upload_id: str, index: int) -> str:
+    return f'uploads/{upload_id}/{index:06d}'
+
+def blob_key(sha256: str) -> str:
+    return f'blobs/{sha256[:2]}/{sha256}'
+
+def iter_chunks(storage, upload_id: str, chunks_total: int) -> Iterator[bytes]:
+    for index in range(chunks_total):
+        yield storage.get(chunk_key(upload_id, index))
+
+def attachment_json(row) -> Dict[str, Any]:
+    return {
+        'id': row[0],
+        'fileName': row[1],
+        'mimeType': row[2],
+        'size': row[3],
+        'width': row[4],
+        'height': row[5],
+        'duration': row[6],
+        'thumbnailId': row[7],
+        'url': row[8],
+        'sha256': row[9]
+    }
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Первый диапазон из заголовка Range (bytes=start-end, bytes=start- или bytes=-suffix)
+    как (start, end) включительно; None, если диапазон не разобран или вне файла
+    """
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*(,.*)?', header)
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start >= size or start > end:
+        return None
+    return start, end
+
+def content_disposition(file_name: Optional[str]) -> str:
+    """
+    Content-Disposition с ASCII-именем для старых клиентов и полным именем по RFC 5987
+    """
+    name = file_name or 'file'
+    fallback = re.sub(r'[^A-Za-z0-9._ -]', '_', name)
+    return f"inline; filename=\"{fallback}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+ATTACHMENT_COLUMNS = 'id, file_name, mime_type, size, width, height, duration, thumbnail_id, url, sha256'
+
+# Вложение доступно владельцу, участникам чатов, где оно (или файл того же владельца,
+# для которого оно превью) прикреплено к сообщению, и всем, если это аватар или баннер профиля.
+# Параметры: (user_id, user_id)
+ACCESS_CONDITION = """
+    (a.user_id = %s
+     OR EXISTS (
+        SELECT 1 FROM attachments p
+        JOIN message_attachments ma ON ma.attachment_id = p.id
+        JOIN messages m ON m.id = ma.message_id
+        JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = %s
+        WHERE p.id = a.id OR (p.thumbnail_id = a.id AND p.user_id = a.user_id)
+     )
+     OR EXISTS (
+        SELECT 1 FROM users u WHERE u.avatar_attachment_id = a.id OR u.banner_attachment_id = a.id
+     ))
+"""
+
+CONN = None
+CONN_USED_AT = 0.0
+IDLE_CHECK_SECONDS = 30
+
+def get_connection():
+    """
+    Соединение с БД, переиспользуемое тёплыми вызовами функции.
+    Простаивающее соединение не должно получать данных: если сокет читается,
+    сервер или пулер уже закрыл его (перезапуск, таймаут простоя). После простоя
+    дольше IDLE_CHECK_SECONDS соединение дополнительно проверяется запросом SELECT 1.
+    """
+    global CONN, CONN_USED_AT
+    if CONN is not None and not CONN.closed:
+        try:
+            if select.select([CONN], [], [], 0)[0]:
+                raise ConnectionError('connection closed by server')
+            if time.monotonic() - CONN_USED_AT > IDLE_CHECK_SECONDS:
+                cur = CONN.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                CONN.rollback()
+        except Exception:
+            CONN.close()
+    if CONN is None or CONN.closed:
+        import psycopg2
+        CONN = psycopg2.connect(os.environ['DATABASE_URL'])
+    CONN_USED_AT = time.monotonic()
+    return CONN
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Загрузка вложений по частям с дедупликацией по хешу содержимого
+    """
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, Range',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        if (event.get('queryStringParameters') or {}).get('action') == 'warmup':
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            get_storage()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'warm': True}),
+                'isBase64Encoded': False
+            }
+        
+        headers = event.get('headers', {})
+        user_id = headers.get('x-user-id') or headers.get('X-User-Id')
+        storage = get_storage()
+        
+        if method == 'GET':
+            params = event.get('queryStringParameters', {})
+            action = params.get('action')
+            
+            if action == 'upload_status':
+                upload_id = params.get('upload_id')
+                
+                cur.execute(
+                    "SELECT id, status, chunk_size, chunks_total, attachment_id FROM uploads WHERE id = %s AND user_id = %s",
+                    (upload_id, user_id)
+                )
+                upload = cur.fetchone()
+                if not upload:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Upload not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute("SELECT chunk_index FROM upload_chunks WHERE upload_id = %s ORDER BY chunk_index", (upload_id,))
+                received = [row[0] for row in cur.fetchall()]
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'uploadId': upload[0],
+                        'status': upload[1],
+                        'chunkSize': upload[2],
+                        'chunksTotal': upload[3],
+                        'attachmentId': upload[4],
+                        'received': received
+                    }),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'attachment':
+                attachment_id = params.get('id')
+                
+                cur.execute(f"SELECT {ATTACHMENT_COLUMNS} FROM attachments a WHERE a.id = %s AND {ACCESS_CONDITION}",
+                           (attachment_id, user_id, user_id))
+                attachment = cur.fetchone()
+                if not attachment:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Attachment not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(attachment_json(attachment)),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'download':
+                attachment_id = params.get('id')
+                
+                cur.execute(f"""
+                    SELECT a.mime_type, a.file_name, b.storage_key, b.size
+                    FROM attachments a
+                    JOIN attachment_blobs b ON a.sha256 = b.sha256
+                    WHERE a.id = %s AND {ACCESS_CONDITION}
+                """, (attachment_id, user_id, user_id))
+                blob = cur.fetchone()
+                if not blob:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Attachment not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                size = blob[3]
+                range_header = headers.get('range') or headers.get('Range')
+                byte_range = parse_range(range_header, size) if range_header else None
+                if range_header and not byte_range:
+                    return {
+                        'statusCode': 416,
+                        'headers': {
+                            'Content-Type': 'application/json',
+                            'Content-Range': f'bytes */{size}',
+                            'Access-Control-Allow-Origin': '*'
+                        },
+                        'body': json.dumps({'error': 'Invalid range'}),
+                        'isBase64Encoded': False
+                    }
+                
+                response_headers = {
+                    'Content-Type': blob[0] or 'application/octet-stream',
+                    'Content-Disposition': content_disposition(blob[1]),
+                    'Cache-Control': 'private, max-age=31536000, immutable',
+                    'Accept-Ranges': 'bytes',
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Expose-Headers': 'Content-Range, Accept-Ranges'
+                }
+                
+                if not byte_range and size <= MAX_DOWNLOAD_SIZE:
+                    return {
+                        'statusCode': 200,
+                        'headers': response_headers,
+                        'body': base64.b64encode(storage.get(blob[2])).decode('ascii'),
+                        'isBase64Encoded': True
+                    }
+                
+                start, end = byte_range or (0, size - 1)
+                end = min(end, start + MAX_DOWNLOAD_SIZE - 1)
+                response_headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+                
+                return {
+                    'statusCode': 206,
+                    'headers': response_headers,
+                    'body': base64.b64encode(storage.get_range(blob[2], start, end - start + 1)).decode('ascii'),
+                    'isBase64Encoded': True
+                }
+        
+        elif method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            action = body.get('action')
+            
+            if action == 'init_upload':
+                size = int(body.get('size', 0))
+                sha256 = (body.get('sha256') or '').lower() or None
+                
+                if size <= 0 or size > MAX_ATTACHMENT_SIZE:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid size'}),
+                        'isBase64Encoded': False
+                    }
+                
+                thumbnail_id = body.get('thumbnail_id')
+                if thumbnail_id is not None:
+                    owned = None
+                    if str(thumbnail_id).isdigit():
+                        cur.execute("SELECT 1 FROM attachments WHERE id = %s AND user_id = %s",
+                                   (int(thumbnail_id), user_id))
+                        owned = cur.fetchone()
+                    if not owned:
+                        return {
+                            'statusCode': 400,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Invalid thumbnail_id'}),
+                            'isBase64Encoded': False
+                        }
+                
+                if sha256:
+                    cur.execute("""
+                        SELECT b.storage_key
+                        FROM attachment_blobs b
+                        JOIN attachments a ON a.sha256 = b.sha256 AND a.user_id = %s
+                        WHERE b.sha256 = %s AND b.size = %s
+                        LIMIT 1
+                    """, (user_id, sha256, size))
+                    blob = cur.fetchone()
+                    if blob:
+                        cur.execute(f"""
+                            INSERT INTO attachments (user_id, sha256, file_name, mime_type, size, width, height, duration, thumbnail_id, url)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                            RETURNING {ATTACHMENT_COLUMNS}
+                        """, (user_id, sha256, body.get('file_name'), body.get('mime_type'), size,
+                              body.get('width'), body.get('height'), body.get('duration'), thumbnail_id,
+                              storage.url(blob[0])))
+                        attachment = cur.fetchone()
+                        conn.commit()
+                        
+                        return {
+                            'statusCode': 200,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'deduplicated': True, 'attachment': attachment_json(attachment)}),
+                            'isBase64Encoded': False
+                        }
+                
+                upload_id = uuid.uuid4().hex
+                chunks_total = math.ceil(size / CHUNK_SIZE)
+                
+                cur.execute("""
+                    INSERT INTO uploads (id, user_id, file_name, mime_type, size, chunk_size, chunks_total,
+                                         sha256, width, height, duration, thumbnail_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                """, (upload_id, user_id, body.get('file_name'), body.get('mime_type'), size, CHUNK_SIZE,
+                      chunks_total, sha256, body.get('width'), body.get('height'), body.get('duration'),
+                      thumbnail_id))
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'deduplicated': False,
+                        'uploadId': upload_id,
+                        'chunkSize': CHUNK_SIZE,
+                        'chunksTotal': chunks_total
+                    }),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'complete_upload':
+                upload_id = body.get('upload_id')
+                
+                cur.execute("""
+                    SELECT size, chunks_total, sha256, file_name, mime_type, width, height, duration,
+                           thumbnail_id, status, attachment_id
+                    FROM uploads WHERE id = %s AND user_id = %s
+                    FOR UPDATE
+                """, (upload_id, user_id))
+                upload = cur.fetchone()
+                if not upload:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Upload not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                if upload[9] == 'complete':
+                    cur.execute(f"SELECT {ATTACHMENT_COLUMNS} FROM attachments WHERE id = %s", (upload[10],))
+                    attachment = cur.fetchone()
+                    conn.commit()
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'deduplicated': False, 'attachment': attachment_json(attachment)}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM upload_chunks WHERE upload_id = %s", (upload_id,))
+                received, received_size = cur.fetchone()
+                if received != upload[1] or received_size != upload[0]:
+                    return {
+                        'statusCode': 409,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Upload is incomplete', 'received': received}),
+                        'isBase64Encoded': False
+                    }
+                
+                missing = [index for index in range(upload[1]) if not storage.exists(chunk_key(upload_id, index))]
+                if missing:
+                    cur.execute("DELETE FROM upload_chunks WHERE upload_id = %s AND chunk_index = ANY(%s)",
+                               (upload_id, missing))
+                    conn.commit()
+                    return {
+                        'statusCode': 409,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Chunks are missing, upload them again', 'missing': missing}),
+                        'isBase64Encoded': False
+                    }
+                
+                digest = hashlib.sha256()
+                for chunk in iter_chunks(storage, upload_id, upload[1]):
+                    digest.update(chunk)
+                sha256 = digest.hexdigest()
+                
+                if upload[2] and upload[2] != sha256:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Checksum mismatch'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute("SELECT storage_key FROM attachment_blobs WHERE sha256 = %s", (sha256,))
+                blob = cur.fetchone()
+                deduplicated = blob is not None
+                if deduplicated:
+                    key = blob[0]
+                else:
+                    key = blob_key(sha256)
+                    storage.put_stream(key, iter_chunks(storage, upload_id, upload[1]))
+                    cur.execute(
+                        "INSERT INTO attachment_blobs (sha256, size, storage_key) VALUES (%s, %s, %s) ON CONFLICT (sha256) DO NOTHING",
+                        (sha256, upload[0], key)
+                    )
+                
+                cur.execute(f"""
+                    INSERT INTO attachments (user_id, sha256, file_name, mime_type, size, width, height, duration, thumbnail_id, url)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    RETURNING {ATTACHMENT_COLUMNS}
+                """, (user_id, sha256, upload[3], upload[4], upload[0], upload[5], upload[6], upload[7], upload[8],
+                      storage.url(key)))
+                attachment = cur.fetchone()
+                
+                cur.execute("UPDATE uploads SET status = 'complete', attachment_id = %s WHERE id = %s",
+                           (attachment[0], upload_id))
+                cur.execute("DELETE FROM upload_chunks WHERE upload_id = %s", (upload_id,))
+                conn.commit()
+                
+                for index in range(upload[1]):
+                    storage.delete(chunk_key(upload_id, index))
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'deduplicated': deduplicated, 'attachment': attachment_json(attachment)}),
+                    'isBase64Encoded': False
+                }
+        
+        elif method == 'PUT':
+            body = json.loads(event.get('body', '{}'))
+            action = body.get('action')
+            
+            if action == 'upload_chunk':
+                upload_id = body.get('upload_id')
+                index = int(body.get('index', -1))
+                data = base64.b64decode(body.get('data', ''))
+                
+                cur.execute(
+                    "SELECT size, chunk_size, chunks_total, status FROM uploads WHERE id = %s AND user_id = %s",
+                    (upload_id, user_id)
+                )
+                upload = cur.fetchone()
+                if not upload or upload[3] != 'pending':
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Upload not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                expected_size = min(upload[1], upload[0] - index * upload[1])
+                if index < 0 or index >= upload[2] or len(data) != expected_size:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Invalid chunk'}),
+                        'isBase64Encoded': False
+                    }
+                
+                storage.put(chunk_key(upload_id, index), data)
+                cur.execute("""
+                    INSERT INTO upload_chunks (upload_id, chunk_index, size) VALUES (%s, %s, %s)
+                    ON CONFLICT (upload_id, chunk_index) DO UPDATE SET size = EXCLUDED.size
+                """, (upload_id, index, len(data)))
+                cur.execute("SELECT COUNT(*) FROM upload_chunks WHERE upload_id = %s", (upload_id,))
+                received = cur.fetchone()[0]
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'received': received, 'chunksTotal': upload[2]}),
+                    'isBase64Encoded': False
+                }
+        
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
@@ -1,8 +1,38 @@
 import json
 import os
-import psycopg2
+import select
+import time
 from typing import Dict, Any
 
+CONN = None
+CONN_USED_AT = 0.0
+IDLE_CHECK_SECONDS = 30
+
+def get_connection():
+    """
+    Соединение с БД, переиспользуемое тёплыми вызовами функции.
+    Простаивающее соединение не должно получать данных: если сокет читается,
+    сервер или пулер уже закрыл его (перезапуск, таймаут простоя). После простоя
+    дольше IDLE_CHECK_SECONDS соединение дополнительно проверяется запросом SELECT 1.
+    """
+    global CONN, CONN_USED_AT
+    if CONN is not None and not CONN.closed:
+        try:
+            if select.select([CONN], [], [], 0)[0]:
+                raise ConnectionError('connection closed by server')
+            if time.monotonic() - CONN_USED_AT > IDLE_CHECK_SECONDS:
+                cur = CONN.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                CONN.rollback()
+        except Exception:
+            CONN.close()
+    if CONN is None or CONN.closed:
+        import psycopg2
+        CONN = psycopg2.connect(os.environ['DATABASE_URL'])
+    CONN_USED_AT = time.monotonic()
+    return CONN
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Обрабатывает регистрацию и авторизацию пользователей
@@ -22,10 +52,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
+        if (event.get('queryStringParameters') or {}).get('action') == 'warmup':
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'warm': True}),
+                'isBase64Encoded': False
+            }
+        
         if method == 'POST':
             body = json.loads(event.get('body', '{}'))
             action = body.get('action')
@@ -70,7 +110,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 user = cur.fetchone()
                 
                 if user:
-                    cur.execute("UPDATE users SET is_online = true WHERE id = %s", (user[0],))
+                    cur.execute("UPDATE users SET is_online = true, last_active_at = CURRENT_TIMESTAMP WHERE id = %s", (user[0],))
                     conn.commit()
                     
                     cur.execute(
@@ -110,4 +150,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
@@ -0,0 +1,58 @@
+"""
+Замер холодного старта backend-функций
+
+Каждая функция запускается в отдельном процессе: замеряется импорт модуля,
+первый вызов warmup (открытие соединения) и повторный тёплый вызов.
+Без DATABASE_URL замеряется только импорт.
+
+    python bench_startup.py [--runs 5] [function ...]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+FUNCTIONS = ['auth', 'messages', 'calls', 'profile', 'admin', 'attachments', 'jobs']
+
+PROBE = '''
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+result = {'importMs': (imported - started) * 1000}
+if os.environ.get('DATABASE_URL'):
+    event = {'httpMethod': 'GET', 'queryStringParameters': {'action': 'warmup'}, 'headers': {}}
+    index.handler(event, None)
+    first = time.perf_counter()
+    index.handler(event, None)
+    second = time.perf_counter()
+    result['firstCallMs'] = (first - imported) * 1000
+    result['warmCallMs'] = (second - first) * 1000
+print(json.dumps(result))
+'''
+
+def measure(function: str) -> dict:
+    cwd = os.path.join(os.path.dirname(os.path.abspath(__file__)), function)
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=cwd, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Замер холодного старта функций')
+    parser.add_argument('functions', nargs='*', default=FUNCTIONS)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'function':<12} {'import ms':>10} {'first ms':>10} {'warm ms':>10}")
+    for function in args.functions:
+        runs = [measure(function) for _ in range(args.runs)]
+        row = [function]
+        for key in ('importMs', 'firstCallMs', 'warmCallMs'):
+            values = [r[key] for r in runs if key in r]
+            row.append(f'{statistics.median(values):.1f}' if values else '-')
+        print(f'{row[0]:<12} {row[1]:>10} {row[2]:>10} {row[3]:>10}')
+
+if __name__ == '__main__':
+    main()
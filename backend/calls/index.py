@@ -1,8 +1,103 @@
 import json
 import os
-import psycopg2
+import re
+import select
+import time
 from typing import Dict, Any
 
+STATEMENTS: Dict[str, str] = {
+    'call_history': """
+        SELECT c.id, c.call_type, c.duration, c.status, c.created_at,
+               u1.name as caller_name, u2.name as receiver_name,
+               c.caller_id, c.receiver_id
+        FROM calls c
+        JOIN users u1 ON c.caller_id = u1.id
+        JOIN users u2 ON c.receiver_id = u2.id
+        WHERE c.caller_id = $1 OR c.receiver_id = $1
+        ORDER BY c.created_at DESC
+        LIMIT 50
+    """
+}
+PREPARED: set = set()
+STATEMENT_STATS = {'prepared': 0, 'executed': 0, 'fallback': 0}
+
+def prepare_statements(conn) -> None:
+    """
+    Подготавливает запросы из STATEMENTS один раз на соединение
+    """
+    PREPARED.clear()
+    cur = conn.cursor()
+    for name, sql in STATEMENTS.items():
+        try:
+            cur.execute(f"PREPARE {name} AS {sql}")
+            conn.commit()
+            PREPARED.add(name)
+            STATEMENT_STATS['prepared'] += 1
+        except Exception:
+            conn.rollback()
+    cur.close()
+
+def execute_statement(conn, cur, name: str, params: tuple) -> None:
+    """
+    Выполняет запрос из реестра через EXECUTE, а если он не подготовлен — обычным запросом.
+    Вызывается первым запросом в транзакции: при потере подготовленного запроса транзакция откатывается.
+    """
+    if name in PREPARED:
+        try:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            STATEMENT_STATS['executed'] += 1
+            return
+        except Exception as e:
+            if getattr(e, 'pgcode', None) != '26000':
+                raise
+            conn.rollback()
+            PREPARED.discard(name)
+    cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', STATEMENTS[name]),
+                {f'p{i}': value for i, value in enumerate(params, 1)})
+    STATEMENT_STATS['fallback'] += 1
+
+def statement_metrics(conn, cur) -> Dict[str, Any]:
+    """
+    Счётчики реестра и число переиспользований планов из pg_prepared_statements
+    """
+    metrics: Dict[str, Any] = dict(STATEMENT_STATS, active=sorted(PREPARED))
+    try:
+        cur.execute("SELECT name, generic_plans, custom_plans FROM pg_prepared_statements")
+        metrics['plans'] = {row[0]: {'generic': row[1], 'custom': row[2]} for row in cur.fetchall()}
+    except Exception:
+        conn.rollback()
+    return metrics
+
+CONN = None
+CONN_USED_AT = 0.0
+IDLE_CHECK_SECONDS = 30
+
+def get_connection():
+    """
+    Соединение с БД, переиспользуемое тёплыми вызовами функции.
+    Простаивающее соединение не должно получать данных: если сокет читается,
+    сервер или пулер уже закрыл его (перезапуск, таймаут простоя). После простоя
+    дольше IDLE_CHECK_SECONDS соединение дополнительно проверяется запросом SELECT 1.
+    """
+    global CONN, CONN_USED_AT
+    if CONN is not None and not CONN.closed:
+        try:
+            if select.select([CONN], [], [], 0)[0]:
+                raise ConnectionError('connection closed by server')
+            if time.monotonic() - CONN_USED_AT > IDLE_CHECK_SECONDS:
+                cur = CONN.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                CONN.rollback()
+        except Exception:
+            CONN.close()
+    if CONN is None or CONN.closed:
+        import psycopg2
+        CONN = psycopg2.connect(os.environ['DATABASE_URL'])
+        prepare_statements(CONN)
+    CONN_USED_AT = time.monotonic()
+    return CONN
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Управление звонками между пользователями
@@ -22,10 +117,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
+        if (event.get('queryStringParameters') or {}).get('action') == 'warmup':
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'warm': True, 'statements': statement_metrics(conn, cur)}),
+                'isBase64Encoded': False
+            }
+        
         headers = event.get('headers', {})
         user_id = headers.get('x-user-id') or headers.get('X-User-Id')
         
@@ -49,6 +154,24 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     "INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)",
                     (user_id, 'call_initiated', f'Инициировал {call_type} звонок пользователю {receiver_id}')
                 )
+                cur.execute("""
+                    WITH counters AS (
+                        INSERT INTO user_counters (user_id, calls_made, calls_received)
+                        SELECT u, SUM(made), SUM(received)
+                        FROM (VALUES (%s::int, 1, 0), (%s::int, 0, 1)) AS v(u, made, received)
+                        WHERE u IS NOT NULL
+                        GROUP BY u
+                        ON CONFLICT (user_id) DO UPDATE
+                        SET calls_made = user_counters.calls_made + EXCLUDED.calls_made,
+                            calls_received = user_counters.calls_received + EXCLUDED.calls_received
+                    ), presence AS (
+                        UPDATE users SET is_online = true, last_active_at = CURRENT_TIMESTAMP WHERE id = %s
+                    )
+                    INSERT INTO user_activity_daily (user_id, day, calls)
+                    SELECT DISTINCT u, CURRENT_DATE, 1 FROM unnest(ARRAY[%s, %s]::int[]) u
+                    WHERE u IS NOT NULL
+                    ON CONFLICT (user_id, day) DO UPDATE SET calls = user_activity_daily.calls + 1
+                """, (user_id, receiver_id, user_id, user_id, receiver_id))
                 conn.commit()
                 
                 return {
@@ -141,17 +264,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = params.get('action')
             
             if action == 'call_history':
-                cur.execute("""
-                    SELECT c.id, c.call_type, c.duration, c.status, c.created_at,
-                           u1.name as caller_name, u2.name as receiver_name,
-                           c.caller_id, c.receiver_id
-                    FROM calls c
-                    JOIN users u1 ON c.caller_id = u1.id
-                    JOIN users u2 ON c.receiver_id = u2.id
-                    WHERE c.caller_id = %s OR c.receiver_id = %s
-                    ORDER BY c.created_at DESC
-                    LIMIT 50
-                """, (user_id, user_id))
+                execute_statement(conn, cur, 'call_history', (user_id,))
                 
                 calls_data = cur.fetchall()
                 calls = []
@@ -183,4 +296,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
@@ -0,0 +1,321 @@
+import json
+import os
+import select
+import sys
+import time
+from typing import Dict, Any, Callable, List, Optional
+
+CHUNK_SIZE = int(os.environ.get('JOBS_CHUNK_SIZE', 500))
+TIME_BUDGET_SECONDS = int(os.environ.get('JOBS_TIME_BUDGET_SECONDS', 20))
+OFFLINE_AFTER_SECONDS = int(os.environ.get('OFFLINE_AFTER_SECONDS', 300))
+RINGING_TIMEOUT_SECONDS = int(os.environ.get('RINGING_TIMEOUT_SECONDS', 60))
+ACTIVITY_LOG_RETENTION_DAYS = int(os.environ.get('ACTIVITY_LOG_RETENTION_DAYS', 90))
+COUNTERS_REFRESH_HOURS = int(os.environ.get('COUNTERS_REFRESH_HOURS', 24))
+# Задачи берут pg_try_advisory_lock(hashtext(JOBS_LOCK_NAMESPACE), hashtext(имя задачи)):
+# отдельное пространство ключей не пересекается с другими advisory lock в этой базе
+JOBS_LOCK_NAMESPACE = 'maintenance_jobs'
+
+def mark_offline(cur, limit: int) -> int:
+    """
+    Снимает is_online с пользователей без активности дольше OFFLINE_AFTER_SECONDS.
+    Активность (users.last_active_at) отмечают вход, смена статуса, опрос чатов
+    и сообщений, отправка сообщений и звонки.
+    """
+    cur.execute("""
+        UPDATE users SET is_online = false
+        WHERE id IN (
+            SELECT id FROM users
+            WHERE is_online = true
+              AND (last_active_at IS NULL OR last_active_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (OFFLINE_AFTER_SECONDS, limit))
+    return cur.rowcount
+
+def expire_ringing_calls(cur, limit: int) -> int:
+    """
+    Помечает звонки, которые звонят дольше RINGING_TIMEOUT_SECONDS, как пропущенные
+    """
+    cur.execute("""
+        UPDATE calls SET status = 'missed'
+        WHERE id IN (
+            SELECT id FROM calls
+            WHERE status = 'ringing' AND created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (RINGING_TIMEOUT_SECONDS, limit))
+    return cur.rowcount
+
+def prune_activity_logs(cur, limit: int) -> int:
+    """
+    Удаляет записи журнала старше ACTIVITY_LOG_RETENTION_DAYS
+    """
+    cur.execute("""
+        DELETE FROM activity_logs
+        WHERE id IN (
+            SELECT id FROM activity_logs
+            WHERE created_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (ACTIVITY_LOG_RETENTION_DAYS, limit))
+    return cur.rowcount
+
+def refresh_counters(cur, limit: int) -> int:
+    """
+    Пересчитывает messages_sent, calls_made и calls_received по таблицам messages и calls.
+    За пачку создаёт недостающие строки user_counters, затем пересчитывает строки,
+    не обновлявшиеся дольше COUNTERS_REFRESH_HOURS, начиная с самых старых.
+    """
+    cur.execute("""
+        INSERT INTO user_counters (user_id, messages_sent, calls_made, calls_received, refreshed_at)
+        SELECT u.id,
+               (SELECT COUNT(*) FROM messages WHERE sender_id = u.id),
+               (SELECT COUNT(*) FROM calls WHERE caller_id = u.id),
+               (SELECT COUNT(*) FROM calls WHERE receiver_id = u.id),
+               CURRENT_TIMESTAMP
+        FROM users u
+        WHERE NOT EXISTS (SELECT 1 FROM user_counters c WHERE c.user_id = u.id)
+        ORDER BY u.id
+        LIMIT %s
+        ON CONFLICT (user_id) DO NOTHING
+    """, (limit,))
+    inserted = cur.rowcount
+    if inserted >= limit:
+        return inserted
+    
+    cur.execute("""
+        UPDATE user_counters c
+        SET messages_sent = (SELECT COUNT(*) FROM messages WHERE sender_id = c.user_id),
+            calls_made = (SELECT COUNT(*) FROM calls WHERE caller_id = c.user_id),
+            calls_received = (SELECT COUNT(*) FROM calls WHERE receiver_id = c.user_id),
+            refreshed_at = CURRENT_TIMESTAMP
+        WHERE c.user_id IN (
+            SELECT user_id FROM user_counters
+            WHERE refreshed_at IS NULL OR refreshed_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 hour'
+            ORDER BY refreshed_at NULLS FIRST
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+    """, (COUNTERS_REFRESH_HOURS, limit - inserted))
+    return inserted + cur.rowcount
+
+JOBS: Dict[str, Callable[[Any, int], int]] = {
+    'mark_offline': mark_offline,
+    'expire_ringing_calls': expire_ringing_calls,
+    'prune_activity_logs': prune_activity_logs,
+    'refresh_counters': refresh_counters
+}
+
+def run_job(conn, name: str, chunk_size: int = CHUNK_SIZE, deadline: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Выполняет задачу пачками по chunk_size строк, каждая пачка — отдельная транзакция.
+    Задачу выполняет только тот экземпляр, который взял advisory lock, остальные её пропускают.
+    """
+    cur = conn.cursor()
+    started = time.perf_counter()
+    metrics: Dict[str, Any] = {'job': name, 'status': 'ok', 'rows': 0, 'chunks': 0, 'error': None}
+    
+    try:
+        cur.execute("SELECT pg_try_advisory_lock(hashtext(%s), hashtext(%s))", (JOBS_LOCK_NAMESPACE, name))
+        locked = cur.fetchone()[0]
+        conn.commit()
+        
+        if not locked:
+            metrics['status'] = 'skipped'
+        else:
+            try:
+                while True:
+                    affected = JOBS[name](cur, chunk_size)
+                    conn.commit()
+                    metrics['rows'] += affected
+                    metrics['chunks'] += 1
+                    if affected < chunk_size or (deadline and time.monotonic() > deadline):
+                        break
+            except Exception as e:
+                conn.rollback()
+                metrics['status'] = 'error'
+                metrics['error'] = str(e)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(hashtext(%s), hashtext(%s))", (JOBS_LOCK_NAMESPACE, name))
+                conn.commit()
+        
+        metrics['ms'] = round((time.perf_counter() - started) * 1000, 1)
+        cur.execute(
+            "INSERT INTO job_runs (job, status, rows_affected, chunks, duration_ms, error) VALUES (%s, %s, %s, %s, %s, %s)",
+            (name, metrics['status'], metrics['rows'], metrics['chunks'], int(metrics['ms']), metrics['error'])
+        )
+        conn.commit()
+    finally:
+        cur.close()
+    
+    print(json.dumps(metrics))
+    return metrics
+
+def run_jobs(conn, names: Optional[List[str]] = None, chunk_size: int = CHUNK_SIZE,
+             time_budget: float = TIME_BUDGET_SECONDS) -> List[Dict[str, Any]]:
+    """
+    Запускает задачи по очереди в пределах общего бюджета времени
+    """
+    deadline = time.monotonic() + time_budget
+    return [run_job(conn, name, chunk_size, deadline) for name in (names or list(JOBS))]
+
+CONN = None
+CONN_USED_AT = 0.0
+IDLE_CHECK_SECONDS = 30
+
+def get_connection():
+    """
+    Соединение с БД, переиспользуемое тёплыми вызовами функции.
+    Простаивающее соединение не должно получать данных: если сокет читается,
+    сервер или пулер уже закрыл его (перезапуск, таймаут простоя). После простоя
+    дольше IDLE_CHECK_SECONDS соединение дополнительно проверяется запросом SELECT 1.
+    """
+    global CONN, CONN_USED_AT
+    if CONN is not None and not CONN.closed:
+        try:
+            if select.select([CONN], [], [], 0)[0]:
+                raise ConnectionError('connection closed by server')
+            if time.monotonic() - CONN_USED_AT > IDLE_CHECK_SECONDS:
+                cur = CONN.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                CONN.rollback()
+        except Exception:
+            CONN.close()
+    if CONN is None or CONN.closed:
+        import psycopg2
+        CONN = psycopg2.connect(os.environ['DATABASE_URL'])
+    CONN_USED_AT = time.monotonic()
+    return CONN
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Фоновые задачи обслуживания: запуск по таймеру или вручную администратором
+    """
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    conn = get_connection()
+    cur = conn.cursor()
+    
+    try:
+        if (event.get('queryStringParameters') or {}).get('action') == 'warmup':
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'warm': True}),
+                'isBase64Encoded': False
+            }
+        
+        if 'httpMethod' not in event:
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json'},
+                'body': json.dumps({'jobs': run_jobs(conn)}),
+                'isBase64Encoded': False
+            }
+        
+        headers = event.get('headers', {})
+        user_id = headers.get('x-user-id') or headers.get('X-User-Id')
+        
+        cur.execute("SELECT is_admin FROM users WHERE id = %s", (user_id,))
+        result = cur.fetchone()
+        conn.commit()
+        
+        if not result or not result[0]:
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Access denied'}),
+                'isBase64Encoded': False
+            }
+        
+        if method == 'GET':
+            params = event.get('queryStringParameters', {})
+            action = params.get('action')
+            
+            if action == 'job_runs':
+                limit = min(int(params.get('limit', 50)), 200)
+                
+                cur.execute("""
+                    SELECT id, job, status, rows_affected, chunks, duration_ms, error, created_at
+                    FROM job_runs
+                    ORDER BY id DESC
+                    LIMIT %s
+                """, (limit,))
+                
+                runs = [{
+                    'id': r[0],
+                    'job': r[1],
+                    'status': r[2],
+                    'rows': r[3],
+                    'chunks': r[4],
+                    'ms': r[5],
+                    'error': r[6],
+                    'time': r[7].isoformat()
+                } for r in cur.fetchall()]
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps(runs),
+                    'isBase64Encoded': False
+                }
+        
+        elif method == 'POST':
+            body = json.loads(event.get('body', '{}'))
+            action = body.get('action')
+            
+            if action == 'run':
+                names = body.get('jobs') or list(JOBS)
+                unknown = [name for name in names if name not in JOBS]
+                if unknown:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Unknown jobs: {", ".join(unknown)}'}),
+                        'isBase64Encoded': False
+                    }
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'jobs': run_jobs(conn, names)}),
+                    'isBase64Encoded': False
+                }
+        
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'}),
+            'isBase64Encoded': False
+        }
+    
+    finally:
+        cur.close()
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
+
+if __name__ == '__main__':
+    for metrics in run_jobs(get_connection(), sys.argv[1:] or None):
+        if metrics['status'] == 'error':
+            sys.exit(1)
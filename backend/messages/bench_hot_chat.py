@@ -0,0 +1,70 @@
+"""
+Нагрузочный замер записи в один активный чат
+
+Несколько процессов (как отдельные экземпляры функции) пишут в один чат
+через send_message по одному сообщению или через send_messages пачками.
+Нужны DATABASE_URL, существующий чат и его участник.
+
+    python bench_hot_chat.py --chat-id 1 --user-id 1 --workers 8 --messages 500 --batch 1
+    python bench_hot_chat.py --chat-id 1 --user-id 1 --workers 8 --messages 500 --batch 20
+"""
+import argparse
+import json
+import multiprocessing
+import statistics
+import time
+from typing import List, Tuple
+
+def worker(args: Tuple[int, str, str, int, int]) -> Tuple[List[float], List[int]]:
+    worker_id, chat_id, user_id, count, batch = args
+    import index
+
+    latencies = []
+    seqs = []
+    sent = 0
+    while sent < count:
+        size = min(batch, count - sent)
+        if batch == 1:
+            body = {'action': 'send_message', 'chat_id': chat_id, 'text': f'bench {worker_id}-{sent}'}
+        else:
+            body = {'action': 'send_messages', 'chat_id': chat_id,
+                    'messages': [{'text': f'bench {worker_id}-{sent + i}', 'client_id': sent + i} for i in range(size)]}
+        event = {'httpMethod': 'POST', 'headers': {'X-User-Id': user_id}, 'body': json.dumps(body)}
+
+        started = time.perf_counter()
+        response = index.handler(event, None)
+        latencies.append(time.perf_counter() - started)
+
+        result = json.loads(response['body'])
+        seqs.extend([result['seq']] if batch == 1 else [m['seq'] for m in result])
+        sent += size
+    return latencies, seqs
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Пропускная способность записи в один чат')
+    parser.add_argument('--chat-id', required=True)
+    parser.add_argument('--user-id', required=True)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=500, help='сообщений на процесс')
+    parser.add_argument('--batch', type=int, default=1, help='1 — send_message, больше — send_messages')
+    args = parser.parse_args()
+
+    tasks = [(i, args.chat_id, args.user_id, args.messages, args.batch) for i in range(args.workers)]
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        results = pool.map(worker, tasks)
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(l for r in results for l in r[0])
+    seqs = sorted(s for r in results for s in r[1])
+    total = len(seqs)
+
+    print(f'messages:    {total}')
+    print(f'elapsed:     {elapsed:.2f} s')
+    print(f'throughput:  {total / elapsed:.0f} msg/s')
+    print(f'request p50: {statistics.median(latencies) * 1000:.1f} ms')
+    print(f'request p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} ms')
+    print(f'seq gapless: {seqs == list(range(seqs[0], seqs[0] + total))}')
+
+if __name__ == '__main__':
+    main()
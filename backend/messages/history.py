@@ -0,0 +1,476 @@
+"""
+Потоковый экспорт и импорт истории чатов в формате NDJSON
+
+Экспорт читает данные серверными курсорами, импорт загружает их через COPY
+во временную таблицу, поэтому расход памяти не зависит от размера истории.
+Вложения переносятся как записи blob и attachment, привязки — списком attachments
+у сообщения, аватары и баннеры — записями profile. Сами файлы не копируются:
+целевая база должна работать с тем же хранилищем или с его копией (storage_key).
+
+    python history.py export --user-id 1 --after 0 > history.ndjson
+    python history.py import history.ndjson --skip 0
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Any, Dict, IO, Iterable, Iterator, Optional
+
+BATCH_SIZE = 1000
+
+EVENT_EDIT = 1
+EVENT_REACT = 2
+EVENT_UNREACT = 3
+EVENT_READ = 4
+EVENT_DELETE = 5
+EVENT_CLEAR = 6
+DELETED_TEXT = 'Сообщение удалено'
+
+def message_deleted_sql(alias: str) -> str:
+    """
+    SQL-условие: сообщение alias удалено автором или попало под очистку чата
+    """
+    return f"""EXISTS (
+            SELECT 1 FROM chat_events e
+            WHERE e.chat_id = {alias}.chat_id AND e.actor_id = {alias}.sender_id
+              AND ((e.kind = {EVENT_DELETE} AND e.message_id = {alias}.id)
+                   OR (e.kind = {EVENT_CLEAR} AND e.message_id >= {alias}.id))
+        )"""
+
+def current_text_sql(alias: str) -> str:
+    """
+    SQL-выражение текущего текста сообщения alias: удаление и очистка чата из журнала
+    chat_events заменяют текст на DELETED_TEXT, иначе берётся последняя правка автора
+    """
+    return f"""CASE
+        WHEN {message_deleted_sql(alias)} THEN '{DELETED_TEXT}'
+        ELSE COALESCE((
+            SELECT e.payload FROM chat_events e
+            WHERE e.message_id = {alias}.id AND e.kind = {EVENT_EDIT} AND e.actor_id = {alias}.sender_id
+            ORDER BY e.seq DESC LIMIT 1
+        ), {alias}.text)
+    END"""
+
+def scope_filter(chat_id: Optional[Any], user_id: Optional[Any]):
+    if chat_id:
+        return 'c.id = %s', (chat_id,)
+    return 'c.id IN (SELECT chat_id FROM chat_members WHERE user_id = %s)', (user_id,)
+
+def dump(record: Dict[str, Any]) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=lambda v: v.isoformat()) + '\n'
+
+def attachment_scope(where: str, params: tuple, after: int, limit: Optional[int]):
+    """
+    CTE exported_attachments: вложения выгружаемых сообщений, при after == 0 — ещё аватары
+    и баннеры участников, плюс превью этих вложений от того же владельца
+    """
+    profiles = '' if after else f"""
+            UNION
+            SELECT unnest(ARRAY[u.avatar_attachment_id, u.banner_attachment_id])
+            FROM users u
+            JOIN chat_members cm ON cm.user_id = u.id
+            JOIN chats c ON c.id = cm.chat_id
+            WHERE {where}"""
+    sql = f"""
+        scope_messages AS (
+            SELECT m.id FROM messages m
+            JOIN chats c ON c.id = m.chat_id
+            WHERE {where} AND m.id > %s
+            ORDER BY m.id
+            {'LIMIT %s' if limit else ''}
+        ),
+        scope_attachments AS (
+            SELECT attachment_id AS id FROM message_attachments
+            WHERE message_id IN (SELECT id FROM scope_messages){profiles}
+        ),
+        exported_attachments AS (
+            SELECT a.* FROM attachments a
+            WHERE a.id IN (SELECT id FROM scope_attachments)
+               OR a.id IN (
+                   SELECT t.thumbnail_id FROM attachments t
+                   JOIN scope_attachments s ON s.id = t.id
+                   JOIN attachments th ON th.id = t.thumbnail_id AND th.user_id = t.user_id
+               )
+        )"""
+    return sql, params + (after or 0,) + ((limit,) if limit else ()) + (() if after else params)
+
+def iter_export(conn, chat_id: Optional[Any] = None, user_id: Optional[Any] = None,
+                after: int = 0, limit: Optional[int] = None,
+                batch_size: int = BATCH_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Выдаёт записи user, blob, attachment, profile, chat, member и message по порядку.
+    after — id последнего выгруженного сообщения (точка возобновления);
+    пользователи, профили, чаты и участники выгружаются только при after == 0,
+    вложения — те, что нужны выгружаемым сообщениям.
+    Текст сообщений выгружается с учётом правок, удалений и очистки чата.
+    """
+    where, params = scope_filter(chat_id, user_id)
+    scope, scope_params = attachment_scope(where, params, after, limit)
+    
+    if not after:
+        cur = conn.cursor(name='history_export_users')
+        cur.itersize = batch_size
+        cur.execute(f"""
+            WITH {scope}
+            SELECT u.id, u.username, u.name, u.avatar, u.created_at
+            FROM users u
+            WHERE u.id IN (
+                SELECT cm.user_id FROM chat_members cm
+                JOIN chats c ON c.id = cm.chat_id
+                WHERE {where}
+            ) OR u.id IN (SELECT user_id FROM exported_attachments)
+            ORDER BY u.id
+        """, scope_params + params)
+        for row in cur:
+            yield {'type': 'user', 'id': row[0], 'username': row[1], 'name': row[2],
+                   'avatar': row[3], 'created_at': row[4]}
+        cur.close()
+    
+    cur = conn.cursor(name='history_export_blobs')
+    cur.itersize = batch_size
+    cur.execute(f"""
+        WITH {scope}
+        SELECT b.sha256, b.size, b.storage_key, b.created_at
+        FROM attachment_blobs b
+        WHERE b.sha256 IN (SELECT sha256 FROM exported_attachments)
+        ORDER BY b.sha256
+    """, scope_params)
+    for row in cur:
+        yield {'type': 'blob', 'sha256': row[0], 'size': row[1], 'storage_key': row[2], 'created_at': row[3]}
+    cur.close()
+    
+    cur = conn.cursor(name='history_export_attachments')
+    cur.itersize = batch_size
+    cur.execute(f"""
+        WITH {scope}
+        SELECT id, user_id, sha256, file_name, mime_type, size, width, height, duration,
+               CASE WHEN thumbnail_id IN (SELECT id FROM exported_attachments) THEN thumbnail_id END,
+               url, created_at
+        FROM exported_attachments
+        ORDER BY id
+    """, scope_params)
+    for row in cur:
+        yield {'type': 'attachment', 'id': row[0], 'user_id': row[1], 'sha256': row[2], 'file_name': row[3],
+               'mime_type': row[4], 'size': row[5], 'width': row[6], 'height': row[7], 'duration': row[8],
+               'thumbnail_id': row[9], 'url': row[10], 'created_at': row[11]}
+    cur.close()
+    
+    if not after:
+        cur = conn.cursor(name='history_export_profiles')
+        cur.itersize = batch_size
+        cur.execute(f"""
+            SELECT DISTINCT u.id, u.avatar_attachment_id, u.banner_attachment_id
+            FROM users u
+            JOIN chat_members cm ON cm.user_id = u.id
+            JOIN chats c ON c.id = cm.chat_id
+            WHERE {where} AND (u.avatar_attachment_id IS NOT NULL OR u.banner_attachment_id IS NOT NULL)
+        """, params)
+        for row in cur:
+            yield {'type': 'profile', 'user_id': row[0], 'avatar_attachment_id': row[1],
+                   'banner_attachment_id': row[2]}
+        cur.close()
+        
+        cur = conn.cursor(name='history_export_chats')
+        cur.itersize = batch_size
+        cur.execute(f"""
+            SELECT c.id, c.name, c.is_group, c.avatar, c.is_pinned, c.created_at, c.created_by,
+                   c.direct_user_low, c.direct_user_high
+            FROM chats c
+            WHERE {where}
+            ORDER BY c.id
+        """, params)
+        for row in cur:
+            yield {'type': 'chat', 'id': row[0], 'name': row[1], 'is_group': row[2], 'avatar': row[3],
+                   'is_pinned': row[4], 'created_at': row[5], 'created_by': row[6],
+                   'direct_user_low': row[7], 'direct_user_high': row[8]}
+        cur.close()
+        
+        cur = conn.cursor(name='history_export_members')
+        cur.itersize = batch_size
+        cur.execute(f"""
+            SELECT cm.chat_id, cm.user_id, cm.joined_at
+            FROM chat_members cm
+            JOIN chats c ON c.id = cm.chat_id
+            WHERE {where}
+            ORDER BY cm.chat_id, cm.user_id
+        """, params)
+        for row in cur:
+            yield {'type': 'member', 'chat_id': row[0], 'user_id': row[1], 'joined_at': row[2]}
+        cur.close()
+    
+    cur = conn.cursor(name='history_export_messages')
+    cur.itersize = batch_size
+    cur.execute(f"""
+        SELECT m.id, m.chat_id, m.sender_id, {current_text_sql('m')}, m.created_at, m.chat_seq,
+               ARRAY(SELECT attachment_id FROM message_attachments WHERE message_id = m.id ORDER BY position)
+        FROM messages m
+        JOIN chats c ON c.id = m.chat_id
+        WHERE {where} AND m.id > %s
+        ORDER BY m.id
+        {'LIMIT %s' if limit else ''}
+    """, params + (after or 0,) + ((limit,) if limit else ()))
+    for row in cur:
+        record = {'type': 'message', 'id': row[0], 'chat_id': row[1], 'sender_id': row[2],
+                  'text': row[3], 'created_at': row[4], 'chat_seq': row[5]}
+        if row[6]:
+            record['attachments'] = row[6]
+        yield record
+    cur.close()
+
+def export_history(conn, out: IO[str], chat_id: Optional[Any] = None, user_id: Optional[Any] = None,
+                   after: int = 0, limit: Optional[int] = None,
+                   checkpoint: Optional[IO[str]] = None, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Пишет NDJSON в out и возвращает id последнего выгруженного сообщения
+    """
+    last_id = after or 0
+    written = 0
+    for record in iter_export(conn, chat_id, user_id, after, limit, batch_size):
+        out.write(dump(record))
+        if record['type'] == 'message':
+            last_id = record['id']
+            written += 1
+            if checkpoint and written % batch_size == 0:
+                out.flush()
+                checkpoint.write(f'{last_id}\n')
+                checkpoint.flush()
+    return last_id
+
+class CopyStream:
+    """
+    Файловый объект для copy_expert: отдаёт строки NDJSON в текстовом формате COPY
+    """
+    def __init__(self, lines: Iterable[str]):
+        self.lines = iter(lines)
+        self.buffer = ''
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            line = line.strip()
+            if line:
+                self.buffer += line.replace('\\', '\\\\') + '\n'
+        if size < 0:
+            chunk, self.buffer = self.buffer, ''
+        else:
+            chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+class HistoryImportError(Exception):
+    pass
+
+def check_import_target(conn) -> None:
+    """
+    Импорт сохраняет исходные id, поэтому в базе не должно быть чатов и сообщений
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM chats), EXISTS (SELECT 1 FROM messages)")
+        has_chats, has_messages = cur.fetchone()
+        conn.rollback()
+    finally:
+        cur.close()
+    if has_chats or has_messages:
+        raise HistoryImportError('в целевой базе уже есть чаты или сообщения, импорт возможен только в пустую базу')
+
+def import_chunk(conn, lines: Iterable[str], first_line: int = 1) -> None:
+    """
+    Загружает пачку строк одной транзакцией. Любой конфликт id или уникальных ключей
+    откатывает пачку и прерывает импорт. Вложение с уже существующим id пропускается,
+    если это тот же файл того же владельца: продолжения выгрузки могут его повторять.
+    Сообщениям из старых выгрузок без chat_seq номера назначаются после последнего номера чата.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS history_import (doc jsonb) ON COMMIT DELETE ROWS")
+        cur.copy_expert("COPY history_import (doc) FROM STDIN", CopyStream(lines))
+        
+        cur.execute("""
+            SELECT (doc->>'id')::int, doc->>'username', u.username
+            FROM history_import
+            JOIN users u ON u.id = (doc->>'id')::int
+            WHERE doc->>'type' = 'user' AND u.username != doc->>'username'
+            LIMIT 1
+        """)
+        mismatch = cur.fetchone()
+        if mismatch:
+            raise HistoryImportError(
+                f'пользователь id={mismatch[0]} ({mismatch[1]}) уже занят пользователем {mismatch[2]}'
+            )
+        
+        cur.execute("""
+            INSERT INTO users (id, username, name, avatar, created_at)
+            SELECT (doc->>'id')::int, doc->>'username', doc->>'name', doc->>'avatar',
+                   (doc->>'created_at')::timestamp
+            FROM history_import
+            WHERE doc->>'type' = 'user'
+              AND NOT EXISTS (SELECT 1 FROM users u WHERE u.id = (doc->>'id')::int)
+        """)
+        cur.execute("""
+            INSERT INTO attachment_blobs (sha256, size, storage_key, created_at)
+            SELECT doc->>'sha256', (doc->>'size')::bigint, doc->>'storage_key', (doc->>'created_at')::timestamp
+            FROM history_import WHERE doc->>'type' = 'blob'
+            ON CONFLICT (sha256) DO NOTHING
+        """)
+        
+        cur.execute("""
+            SELECT (doc->>'id')::int
+            FROM history_import
+            JOIN attachments a ON a.id = (doc->>'id')::int
+            WHERE doc->>'type' = 'attachment'
+              AND (a.user_id IS DISTINCT FROM (doc->>'user_id')::int OR a.sha256 IS DISTINCT FROM doc->>'sha256')
+            LIMIT 1
+        """)
+        mismatch = cur.fetchone()
+        if mismatch:
+            raise HistoryImportError(f'вложение id={mismatch[0]} уже занято другим файлом')
+        
+        cur.execute("""
+            INSERT INTO attachments (id, user_id, sha256, file_name, mime_type, size, width, height, duration,
+                                     thumbnail_id, url, created_at)
+            SELECT (doc->>'id')::int, (doc->>'user_id')::int, doc->>'sha256', doc->>'file_name', doc->>'mime_type',
+                   (doc->>'size')::bigint, (doc->>'width')::int, (doc->>'height')::int, (doc->>'duration')::int,
+                   (doc->>'thumbnail_id')::int, doc->>'url', (doc->>'created_at')::timestamp
+            FROM history_import
+            WHERE doc->>'type' = 'attachment'
+              AND NOT EXISTS (SELECT 1 FROM attachments a WHERE a.id = (doc->>'id')::int)
+        """)
+        cur.execute("""
+            UPDATE users u
+            SET avatar_attachment_id = (doc->>'avatar_attachment_id')::int,
+                banner_attachment_id = (doc->>'banner_attachment_id')::int
+            FROM history_import
+            WHERE doc->>'type' = 'profile' AND u.id = (doc->>'user_id')::int
+        """)
+        cur.execute("""
+            INSERT INTO chats (id, name, is_group, avatar, is_pinned, created_at, created_by,
+                               direct_user_low, direct_user_high)
+            SELECT (doc->>'id')::int, doc->>'name', (doc->>'is_group')::boolean, doc->>'avatar',
+                   (doc->>'is_pinned')::boolean, (doc->>'created_at')::timestamp, (doc->>'created_by')::int,
+                   (doc->>'direct_user_low')::int, (doc->>'direct_user_high')::int
+            FROM history_import WHERE doc->>'type' = 'chat'
+        """)
+        cur.execute("""
+            INSERT INTO chat_members (chat_id, user_id, joined_at)
+            SELECT (doc->>'chat_id')::int, (doc->>'user_id')::int, (doc->>'joined_at')::timestamp
+            FROM history_import WHERE doc->>'type' = 'member'
+        """)
+        cur.execute("""
+            INSERT INTO messages (id, chat_id, sender_id, text, created_at, chat_seq)
+            SELECT (doc->>'id')::int, (doc->>'chat_id')::int, (doc->>'sender_id')::int, doc->>'text',
+                   (doc->>'created_at')::timestamp, (doc->>'chat_seq')::bigint
+            FROM history_import WHERE doc->>'type' = 'message' AND doc->>'chat_seq' IS NOT NULL
+        """)
+        cur.execute("""
+            INSERT INTO messages (id, chat_id, sender_id, text, created_at, chat_seq)
+            SELECT id, chat_id, sender_id, text, created_at,
+                   COALESCE((SELECT MAX(chat_seq) FROM messages WHERE chat_id = n.chat_id), 0)
+                   + ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY created_at, id)
+            FROM (
+                SELECT (doc->>'id')::int as id, (doc->>'chat_id')::int as chat_id, (doc->>'sender_id')::int as sender_id,
+                       doc->>'text' as text, (doc->>'created_at')::timestamp as created_at
+                FROM history_import WHERE doc->>'type' = 'message' AND doc->>'chat_seq' IS NULL
+            ) n
+        """)
+        cur.execute("""
+            INSERT INTO message_attachments (message_id, attachment_id, position)
+            SELECT (doc->>'id')::int, a.value::int, a.ord - 1
+            FROM history_import, jsonb_array_elements_text(doc->'attachments') WITH ORDINALITY AS a(value, ord)
+            WHERE doc->>'type' = 'message' AND doc ? 'attachments'
+        """)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if isinstance(e, HistoryImportError) or str(getattr(e, 'pgcode', '') or '').startswith('23'):
+            raise HistoryImportError(f'строки {first_line}-{first_line + len(lines) - 1}: {e}') from e
+        raise
+    finally:
+        cur.close()
+
+def sync_sequences(conn) -> None:
+    cur = conn.cursor()
+    for table in ('users', 'attachments', 'chats', 'messages'):
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), GREATEST((SELECT MAX(id) FROM {table}), 1))")
+    cur.execute("""
+        UPDATE chats c
+        SET last_message_seq = GREATEST(c.last_message_seq, (SELECT MAX(chat_seq) FROM messages WHERE chat_id = c.id))
+        WHERE EXISTS (SELECT 1 FROM messages WHERE chat_id = c.id)
+    """)
+    conn.commit()
+    cur.close()
+
+def import_history(conn, source: IO[str], skip: int = 0,
+                   checkpoint: Optional[IO[str]] = None, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Загружает NDJSON пачками по batch_size строк, каждая пачка — отдельная транзакция.
+    skip — число уже загруженных строк; возвращает число обработанных строк.
+    Новый импорт (skip == 0) выполняется только в базу без чатов и сообщений.
+    """
+    if not skip:
+        check_import_target(conn)
+    done = 0
+    chunk = []
+    for line in source:
+        if done < skip:
+            done += 1
+            continue
+        chunk.append(line)
+        if len(chunk) >= batch_size:
+            import_chunk(conn, chunk, done + 1)
+            done += len(chunk)
+            chunk = []
+            if checkpoint:
+                checkpoint.write(f'{done}\n')
+                checkpoint.flush()
+    if chunk:
+        import_chunk(conn, chunk, done + 1)
+        done += len(chunk)
+    sync_sequences(conn)
+    return done
+
+def main(argv: Optional[list] = None) -> None:
+    parser = argparse.ArgumentParser(description='Экспорт и импорт истории чатов в NDJSON')
+    sub = parser.add_subparsers(dest='command', required=True)
+    
+    export_cmd = sub.add_parser('export')
+    export_cmd.add_argument('--chat-id')
+    export_cmd.add_argument('--user-id')
+    export_cmd.add_argument('--after', type=int, default=0)
+    export_cmd.add_argument('--output', default='-')
+    export_cmd.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    
+    import_cmd = sub.add_parser('import')
+    import_cmd.add_argument('input')
+    import_cmd.add_argument('--skip', type=int, default=0)
+    import_cmd.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    
+    args = parser.parse_args(argv)
+    import psycopg2
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    
+    try:
+        if args.command == 'export':
+            if not args.chat_id and not args.user_id:
+                parser.error('нужен --chat-id или --user-id')
+            out = sys.stdout if args.output == '-' else open(args.output, 'a' if args.after else 'w', encoding='utf-8')
+            try:
+                last_id = export_history(conn, out, args.chat_id, args.user_id, args.after,
+                                         checkpoint=sys.stderr, batch_size=args.batch_size)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+            sys.stderr.write(f'done {last_id}\n')
+        else:
+            with open(args.input, encoding='utf-8') as source:
+                try:
+                    done = import_history(conn, source, args.skip, checkpoint=sys.stderr, batch_size=args.batch_size)
+                except HistoryImportError as e:
+                    sys.exit(f'import failed: {e}')
+            sys.stderr.write(f'done {done}\n')
+    finally:
+        conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,268 @@
 import json
 import os
-import psycopg2
-from typing import Dict, Any
+import re
+import select
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from history import (iter_export, dump, current_text_sql, message_deleted_sql, DELETED_TEXT,
+                     EVENT_EDIT, EVENT_REACT, EVENT_UNREACT, EVENT_READ, EVENT_DELETE, EVENT_CLEAR)
+
+DIRECT_CHAT_CACHE_SIZE = 1024
+DIRECT_CHAT_CACHE: 'OrderedDict[Tuple[int, int], int]' = OrderedDict()
+
+def direct_chat_key(user_a: Any, user_b: Any) -> Tuple[int, int]:
+    """
+    Канонический ключ личного чата: пара (меньший id, больший id)
+    """
+    a, b = int(user_a), int(user_b)
+    return (a, b) if a <= b else (b, a)
+
+def cache_direct_chat(key: Tuple[int, int], chat_id: int) -> None:
+    DIRECT_CHAT_CACHE[key] = chat_id
+    DIRECT_CHAT_CACHE.move_to_end(key)
+    if len(DIRECT_CHAT_CACHE) > DIRECT_CHAT_CACHE_SIZE:
+        DIRECT_CHAT_CACHE.popitem(last=False)
+
+EVENT_NAMES = {
+    EVENT_EDIT: 'edit',
+    EVENT_REACT: 'react',
+    EVENT_UNREACT: 'unreact',
+    EVENT_READ: 'read',
+    EVENT_DELETE: 'delete',
+    EVENT_CLEAR: 'clear'
+}
+
+def chat_access(cur, chat_id: Any, user_id: Any) -> Optional[bool]:
+    """
+    None — чата нет, False — пользователь не участник, True — участник
+    """
+    cur.execute("""
+        SELECT EXISTS (SELECT 1 FROM chat_members WHERE chat_id = c.id AND user_id = %s)
+        FROM chats c WHERE c.id = %s
+    """, (user_id, chat_id))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def append_event(cur, chat_id: Any, kind: int, actor_id: Any, message_id: Any = None, payload: Any = None) -> int:
+    """
+    Добавляет событие в журнал чата и возвращает его порядковый номер в чате
+    """
+    cur.execute("""
+        WITH s AS (UPDATE chats SET event_seq = event_seq + 1 WHERE id = %s RETURNING event_seq)
+        INSERT INTO chat_events (chat_id, seq, kind, message_id, actor_id, payload)
+        SELECT %s, event_seq, %s, %s, %s, %s FROM s
+        RETURNING seq
+    """, (chat_id, chat_id, kind, message_id, actor_id, payload))
+    return cur.fetchone()[0]
+
+def fold_events(messages: list, events: list, user_id: Any) -> None:
+    """
+    Применяет события (seq, kind, message_id, actor_id, payload) к странице сообщений по порядку seq
+    """
+    by_id = {m['id']: m for m in messages}
+    reactions: Dict[int, Dict[str, set]] = {}
+    read_upto = 0
+    for seq, kind, message_id, actor_id, payload in sorted(events):
+        if kind == EVENT_READ:
+            if str(actor_id) != str(user_id):
+                read_upto = max(read_upto, message_id or 0)
+        elif kind == EVENT_CLEAR:
+            for m in messages:
+                if m['senderId'] == actor_id and m['id'] <= message_id:
+                    m['text'] = DELETED_TEXT
+                    m['deleted'] = True
+        elif message_id in by_id:
+            m = by_id[message_id]
+            if kind == EVENT_EDIT and m['senderId'] == actor_id and not m['deleted']:
+                m['text'] = payload
+                m['edited'] = True
+            elif kind == EVENT_DELETE and m['senderId'] == actor_id:
+                m['text'] = DELETED_TEXT
+                m['deleted'] = True
+            elif kind in (EVENT_REACT, EVENT_UNREACT):
+                users = reactions.setdefault(message_id, {}).setdefault(payload, set())
+                if kind == EVENT_REACT:
+                    users.add(actor_id)
+                else:
+                    users.discard(actor_id)
+    for m in messages:
+        m['reactions'] = [
+            {'emoji': emoji, 'count': len(users), 'me': any(str(u) == str(user_id) for u in users)}
+            for emoji, users in reactions.get(m['id'], {}).items() if users
+        ]
+        m['read'] = m['sender'] == 'me' and m['id'] <= read_upto
+
+MAX_BATCH_SIZE = 100
+PRESENCE_TOUCH_SECONDS = 60
+
+def touch_presence(cur, user_id: Any) -> None:
+    """
+    Отметка присутствия при опросе и отправке: возвращает is_online и обновляет
+    users.last_active_at, по которому задача mark_offline отличает активных пользователей
+    от ушедших. Пишется не чаще раза в PRESENCE_TOUCH_SECONDS; last_seen не трогается —
+    это граница непрочитанных.
+    """
+    cur.execute("""
+        UPDATE users SET is_online = true, last_active_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND (NOT is_online OR last_active_at IS NULL
+                           OR last_active_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+    """, (user_id, PRESENCE_TOUCH_SECONDS))
+
+def parse_attachment_ids(value: Any) -> Optional[list]:
+    """
+    id вложений из запроса; None, если это не список целых чисел
+    """
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        return None
+    try:
+        return [int(a) for a in value]
+    except (TypeError, ValueError):
+        return None
+
+def attach_to_messages(cur, user_id: Any, links: list) -> None:
+    """
+    Привязывает вложения отправителя к сообщениям; links — список (message_id, attachment_id, position)
+    """
+    if not links:
+        return
+    cur.execute("""
+        INSERT INTO message_attachments (message_id, attachment_id, position)
+        SELECT l.message_id, a.id, l.position
+        FROM unnest(%s::int[], %s::int[], %s::int[]) AS l(message_id, attachment_id, position)
+        JOIN attachments a ON a.id = l.attachment_id AND a.user_id = %s
+    """, ([l[0] for l in links], [l[1] for l in links], [l[2] for l in links], user_id))
+
+def log_messages_sent(cur, user_id: Any, chat_id: Any, count: int) -> None:
+    """
+    Журнал действий, счётчики и присутствие пользователя для отправленных сообщений
+    """
+    cur.execute(
+        "INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)",
+        (user_id, 'send_message',
+         f'Отправил сообщение в чат {chat_id}' if count == 1 else f'Отправил {count} сообщений в чат {chat_id}')
+    )
+    cur.execute("""
+        WITH counters AS (
+            INSERT INTO user_counters (user_id, messages_sent) VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET messages_sent = user_counters.messages_sent + EXCLUDED.messages_sent
+        )
+        INSERT INTO user_activity_daily (user_id, day, messages) VALUES (%s, CURRENT_DATE, %s)
+        ON CONFLICT (user_id, day) DO UPDATE SET messages = user_activity_daily.messages + EXCLUDED.messages
+    """, (user_id, count, user_id, count))
+    touch_presence(cur, user_id)
+
+STATEMENTS: Dict[str, str] = {
+    'chats': f"""
+        SELECT DISTINCT c.id, c.name, c.is_group, c.avatar, c.is_pinned,
+               u.id, u.name, u.username, u.avatar, u.is_online,
+               (SELECT {current_text_sql('m')} FROM messages m
+                WHERE m.chat_id = c.id ORDER BY m.chat_seq DESC LIMIT 1) as last_message,
+               (SELECT created_at FROM messages WHERE chat_id = c.id ORDER BY chat_seq DESC LIMIT 1) as last_message_time,
+               (SELECT COUNT(*) FROM messages m WHERE m.chat_id = c.id AND m.sender_id != $1
+                AND m.created_at > COALESCE((SELECT last_seen FROM users WHERE id = $1), '1970-01-01')) as unread_count
+        FROM chats c
+        JOIN chat_members cm ON c.id = cm.chat_id
+        LEFT JOIN chat_members cm2 ON c.id = cm2.chat_id AND cm2.user_id != $1
+        LEFT JOIN users u ON cm2.user_id = u.id
+        WHERE cm.user_id = $1
+        ORDER BY c.is_pinned DESC, last_message_time DESC NULLS LAST
+    """,
+    'messages': """
+        SELECT m.id, m.text, m.sender_id, m.created_at, u.name, u.avatar, m.chat_seq
+        FROM messages m
+        JOIN users u ON m.sender_id = u.id
+        WHERE m.chat_id = $1
+        ORDER BY m.chat_seq ASC
+    """,
+    'send_message': """
+        WITH s AS (UPDATE chats SET last_message_seq = last_message_seq + 1 WHERE id = $1 RETURNING last_message_seq)
+        INSERT INTO messages (chat_id, sender_id, text, chat_seq)
+        SELECT $1, $2, $3, last_message_seq FROM s
+        RETURNING id, created_at, chat_seq
+    """
+}
+PREPARED: set = set()
+STATEMENT_STATS = {'prepared': 0, 'executed': 0, 'fallback': 0}
+
+def prepare_statements(conn) -> None:
+    """
+    Подготавливает запросы из STATEMENTS один раз на соединение
+    """
+    PREPARED.clear()
+    cur = conn.cursor()
+    for name, sql in STATEMENTS.items():
+        try:
+            cur.execute(f"PREPARE {name} AS {sql}")
+            conn.commit()
+            PREPARED.add(name)
+            STATEMENT_STATS['prepared'] += 1
+        except Exception:
+            conn.rollback()
+    cur.close()
+
+def execute_statement(conn, cur, name: str, params: tuple) -> None:
+    """
+    Выполняет запрос из реестра через EXECUTE, а если он не подготовлен — обычным запросом.
+    Вызывается первым запросом в транзакции: при потере подготовленного запроса транзакция откатывается.
+    """
+    if name in PREPARED:
+        try:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            STATEMENT_STATS['executed'] += 1
+            return
+        except Exception as e:
+            if getattr(e, 'pgcode', None) != '26000':
+                raise
+            conn.rollback()
+            PREPARED.discard(name)
+    cur.execute(re.sub(r'\$(\d+)', r'%(p\1)s', STATEMENTS[name]),
+                {f'p{i}': value for i, value in enumerate(params, 1)})
+    STATEMENT_STATS['fallback'] += 1
+
+def statement_metrics(conn, cur) -> Dict[str, Any]:
+    """
+    Счётчики реестра и число переиспользований планов из pg_prepared_statements
+    """
+    metrics: Dict[str, Any] = dict(STATEMENT_STATS, active=sorted(PREPARED))
+    try:
+        cur.execute("SELECT name, generic_plans, custom_plans FROM pg_prepared_statements")
+        metrics['plans'] = {row[0]: {'generic': row[1], 'custom': row[2]} for row in cur.fetchall()}
+    except Exception:
+        conn.rollback()
+    return metrics
+
+CONN = None
+CONN_USED_AT = 0.0
+IDLE_CHECK_SECONDS = 30
+
+def get_connection():
+    """
+    Соединение с БД, переиспользуемое тёплыми вызовами функции.
+    Простаивающее соединение не должно получать данных: если сокет читается,
+    сервер или пулер уже закрыл его (перезапуск, таймаут простоя). После простоя
+    дольше IDLE_CHECK_SECONDS соединение дополнительно проверяется запросом SELECT 1.
+    """
+    global CONN, CONN_USED_AT
+    if CONN is not None and not CONN.closed:
+        try:
+            if select.select([CONN], [], [], 0)[0]:
+                raise ConnectionError('connection closed by server')
+            if time.monotonic() - CONN_USED_AT > IDLE_CHECK_SECONDS:
+                cur = CONN.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                CONN.rollback()
+        except Exception:
+            CONN.close()
+    if CONN is None or CONN.closed:
+        import psycopg2
+        CONN = psycopg2.connect(os.environ['DATABASE_URL'])
+        prepare_statements(CONN)
+    CONN_USED_AT = time.monotonic()
+    return CONN
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
@@ -22,10 +283,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
+        if (event.get('queryStringParameters') or {}).get('action') == 'warmup':
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'warm': True, 'statements': statement_metrics(conn, cur)}),
+                'isBase64Encoded': False
+            }
+        
         headers = event.get('headers', {})
         user_id = headers.get('x-user-id') or headers.get('X-User-Id')
         
@@ -34,22 +305,11 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             action = params.get('action')
             
             if action == 'chats':
-                cur.execute("""
-                    SELECT DISTINCT c.id, c.name, c.is_group, c.avatar, c.is_pinned,
-                           u.id, u.name, u.username, u.avatar, u.is_online,
-                           (SELECT text FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                           (SELECT created_at FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message_time,
-                           (SELECT COUNT(*) FROM messages m WHERE m.chat_id = c.id AND m.sender_id != %s 
-                            AND m.created_at > COALESCE((SELECT last_seen FROM users WHERE id = %s), '1970-01-01')) as unread_count
-                    FROM chats c
-                    JOIN chat_members cm ON c.id = cm.chat_id
-                    LEFT JOIN chat_members cm2 ON c.id = cm2.chat_id AND cm2.user_id != %s
-                    LEFT JOIN users u ON cm2.user_id = u.id
-                    WHERE cm.user_id = %s
-                    ORDER BY c.is_pinned DESC, last_message_time DESC NULLS LAST
-                """, (user_id, user_id, user_id, user_id))
+                execute_statement(conn, cur, 'chats', (user_id,))
                 
                 chats_data = cur.fetchall()
+                touch_presence(cur, user_id)
+                conn.commit()
                 chats = []
                 for chat in chats_data:
                     chats.append({
@@ -76,15 +336,34 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             elif action == 'messages':
                 chat_id = params.get('chat_id')
                 
-                cur.execute("""
-                    SELECT m.id, m.text, m.sender_id, m.created_at, u.name, u.avatar
-                    FROM messages m
-                    JOIN users u ON m.sender_id = u.id
-                    WHERE m.chat_id = %s
-                    ORDER BY m.created_at ASC
-                """, (chat_id,))
+                execute_statement(conn, cur, 'messages', (chat_id,))
                 
                 messages_data = cur.fetchall()
+                touch_presence(cur, user_id)
+                conn.commit()
+                
+                attachments: Dict[int, list] = {}
+                if messages_data:
+                    cur.execute("""
+                        SELECT ma.message_id, a.id, a.file_name, a.mime_type, a.size, a.width, a.height,
+                               a.thumbnail_id, a.url
+                        FROM message_attachments ma
+                        JOIN attachments a ON ma.attachment_id = a.id
+                        WHERE ma.message_id = ANY(%s)
+                        ORDER BY ma.message_id, ma.position
+                    """, ([msg[0] for msg in messages_data],))
+                    for att in cur.fetchall():
+                        attachments.setdefault(att[0], []).append({
+                            'id': att[1],
+                            'fileName': att[2],
+                            'mimeType': att[3],
+                            'size': att[4],
+                            'width': att[5],
+                            'height': att[6],
+                            'thumbnailId': att[7],
+                            'url': att[8]
+                        })
+                
                 messages = []
                 for msg in messages_data:
                     messages.append({
@@ -94,9 +373,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                         'sender': 'me' if str(msg[2]) == str(user_id) else 'other',
                         'time': msg[3].strftime('%H:%M'),
                         'senderName': msg[4],
-                        'senderAvatar': msg[5]
+                        'senderAvatar': msg[5],
+                        'seq': msg[6],
+                        'attachments': attachments.get(msg[0], []),
+                        'edited': False,
+                        'deleted': False
                     })
                 
+                if messages:
+                    cur.execute("""
+                        SELECT seq, kind, message_id, actor_id, payload
+                        FROM chat_events
+                        WHERE chat_id = %s AND message_id = ANY(%s) AND kind IN (%s, %s, %s, %s)
+                        UNION ALL
+                        SELECT seq, kind, message_id, actor_id, payload
+                        FROM chat_events
+                        WHERE chat_id = %s AND kind = %s
+                        UNION ALL
+                        SELECT * FROM (
+                            SELECT DISTINCT ON (actor_id) seq, kind, message_id, actor_id, payload
+                            FROM chat_events
+                            WHERE chat_id = %s AND kind = %s
+                            ORDER BY actor_id, seq DESC
+                        ) reads
+                    """, (chat_id, [m['id'] for m in messages], EVENT_EDIT, EVENT_REACT, EVENT_UNREACT, EVENT_DELETE,
+                          chat_id, EVENT_CLEAR, chat_id, EVENT_READ))
+                    fold_events(messages, cur.fetchall(), user_id)
+                
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -104,6 +407,51 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'isBase64Encoded': False
                 }
             
+            elif action == 'events':
+                chat_id = params.get('chat_id')
+                since_seq = int(params.get('since_seq', 0))
+                limit = min(int(params.get('limit', 500)), 1000)
+                
+                access = chat_access(cur, chat_id, user_id)
+                if not access:
+                    return {
+                        'statusCode': 404 if access is None else 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Chat not found' if access is None else 'Access denied'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute(f"""
+                    SELECT ev.seq, ev.kind, ev.message_id, ev.actor_id,
+                           CASE WHEN ev.kind = %s AND {message_deleted_sql('m')} THEN NULL ELSE ev.payload END,
+                           ev.created_at
+                    FROM chat_events ev
+                    LEFT JOIN messages m ON m.id = ev.message_id
+                    WHERE ev.chat_id = %s AND ev.seq > %s
+                    ORDER BY ev.seq
+                    LIMIT %s
+                """, (EVENT_EDIT, chat_id, since_seq, limit))
+                
+                events = [{
+                    'seq': e[0],
+                    'type': EVENT_NAMES[e[1]],
+                    'messageId': e[2],
+                    'userId': e[3],
+                    'payload': e[4],
+                    'time': e[5].isoformat()
+                } for e in cur.fetchall()]
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({
+                        'events': events,
+                        'seq': events[-1]['seq'] if events else since_seq,
+                        'hasMore': len(events) == limit
+                    }),
+                    'isBase64Encoded': False
+                }
+            
             elif action == 'search_users':
                 query = params.get('query', '')
                 
@@ -131,6 +479,38 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'body': json.dumps(users),
                     'isBase64Encoded': False
                 }
+            
+            elif action == 'export_history':
+                chat_id = params.get('chat_id')
+                after = int(params.get('after', 0))
+                limit = min(int(params.get('limit', 1000)), 5000)
+                
+                if chat_id:
+                    cur.execute("SELECT 1 FROM chat_members WHERE chat_id = %s AND user_id = %s", (chat_id, user_id))
+                    if not cur.fetchone():
+                        return {
+                            'statusCode': 403,
+                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                            'body': json.dumps({'error': 'Access denied'}),
+                            'isBase64Encoded': False
+                        }
+                
+                lines = []
+                last_id = after
+                exported = 0
+                for record in iter_export(conn, chat_id=chat_id, user_id=user_id, after=after, limit=limit):
+                    lines.append(dump(record))
+                    if record['type'] == 'message':
+                        last_id = record['id']
+                        exported += 1
+                lines.append(dump({'type': 'checkpoint', 'after': last_id, 'done': exported < limit}))
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/x-ndjson', 'Access-Control-Allow-Origin': '*'},
+                    'body': ''.join(lines),
+                    'isBase64Encoded': False
+                }
         
         elif method == 'POST':
             body = json.loads(event.get('body', '{}'))
@@ -138,19 +518,29 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             
             if action == 'send_message':
                 chat_id = body.get('chat_id')
-                text = body.get('text')
+                text = body.get('text') or ''
+                attachment_ids = parse_attachment_ids(body.get('attachment_ids'))
                 
-                cur.execute(
-                    "INSERT INTO messages (chat_id, sender_id, text) VALUES (%s, %s, %s) RETURNING id, created_at",
-                    (chat_id, user_id, text)
-                )
+                if attachment_ids is None:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'attachment_ids must be a list of integers'}),
+                        'isBase64Encoded': False
+                    }
+                
+                execute_statement(conn, cur, 'send_message', (chat_id, user_id, text))
                 message = cur.fetchone()
-                conn.commit()
+                if not message:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Chat not found'}),
+                        'isBase64Encoded': False
+                    }
                 
-                cur.execute(
-                    "INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)",
-                    (user_id, 'send_message', f'Отправил сообщение в чат {chat_id}')
-                )
+                attach_to_messages(cur, user_id, [(message[0], a, i) for i, a in enumerate(attachment_ids)])
+                log_messages_sent(cur, user_id, chat_id, 1)
                 conn.commit()
                 
                 return {
@@ -158,44 +548,127 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                     'body': json.dumps({
                         'id': message[0],
+                        'seq': message[2],
                         'time': message[1].strftime('%H:%M')
                     }),
                     'isBase64Encoded': False
                 }
             
+            elif action == 'send_messages':
+                chat_id = body.get('chat_id')
+                batch = body.get('messages', [])
+                
+                if not isinstance(batch, list) or not batch or len(batch) > MAX_BATCH_SIZE:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'Batch must contain 1-{MAX_BATCH_SIZE} messages'}),
+                        'isBase64Encoded': False
+                    }
+                
+                batch_attachments = [parse_attachment_ids(m.get('attachment_ids')) if isinstance(m, dict) else None
+                                     for m in batch]
+                if None in batch_attachments:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Each message must be an object with a list of integer attachment_ids'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute("""
+                    WITH s AS (
+                        UPDATE chats SET last_message_seq = last_message_seq + %s WHERE id = %s
+                        RETURNING last_message_seq
+                    )
+                    INSERT INTO messages (chat_id, sender_id, text, chat_seq)
+                    SELECT %s, %s, t.text, s.last_message_seq - %s + t.ord
+                    FROM s, unnest(%s::text[]) WITH ORDINALITY AS t(text, ord)
+                    RETURNING id, created_at, chat_seq
+                """, (len(batch), chat_id, chat_id, user_id, len(batch), [m.get('text') or '' for m in batch]))
+                inserted = sorted(cur.fetchall(), key=lambda row: row[2])
+                if not inserted:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Chat not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                attach_to_messages(cur, user_id, [
+                    (row[0], a, i)
+                    for row, ids in zip(inserted, batch_attachments)
+                    for i, a in enumerate(ids)
+                ])
+                log_messages_sent(cur, user_id, chat_id, len(inserted))
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps([{
+                        'id': row[0],
+                        'seq': row[2],
+                        'time': row[1].strftime('%H:%M'),
+                        'clientId': m.get('client_id')
+                    } for row, m in zip(inserted, batch)]),
+                    'isBase64Encoded': False
+                }
+            
             elif action == 'create_chat':
                 other_user_id = body.get('user_id')
+                try:
+                    key = direct_chat_key(user_id, other_user_id)
+                except (TypeError, ValueError):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'user_id and X-User-Id are required'}),
+                        'isBase64Encoded': False
+                    }
                 
-                cur.execute("""
-                    SELECT c.id FROM chats c
-                    JOIN chat_members cm1 ON c.id = cm1.chat_id AND cm1.user_id = %s
-                    JOIN chat_members cm2 ON c.id = cm2.chat_id AND cm2.user_id = %s
-                    WHERE c.is_group = false
-                    LIMIT 1
-                """, (user_id, other_user_id))
-                
-                existing = cur.fetchone()
-                if existing:
+                chat_id = DIRECT_CHAT_CACHE.get(key)
+                if chat_id:
+                    DIRECT_CHAT_CACHE.move_to_end(key)
                     return {
                         'statusCode': 200,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'chat_id': existing[0]}),
+                        'body': json.dumps({'chat_id': chat_id}),
                         'isBase64Encoded': False
                     }
                 
-                cur.execute("INSERT INTO chats (is_group, created_by) VALUES (false, %s) RETURNING id", (user_id,))
+                cur.execute("""
+                    INSERT INTO chats (is_group, created_by, direct_user_low, direct_user_high)
+                    VALUES (false, %s, %s, %s)
+                    ON CONFLICT (direct_user_low, direct_user_high) DO NOTHING
+                    RETURNING id
+                """, (user_id, key[0], key[1]))
                 chat = cur.fetchone()
-                chat_id = chat[0]
                 
-                cur.execute("INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
-                           (chat_id, user_id, chat_id, other_user_id))
-                conn.commit()
+                if not chat:
+                    cur.execute("SELECT id FROM chats WHERE direct_user_low = %s AND direct_user_high = %s",
+                               key)
+                    chat_id = cur.fetchone()[0]
+                    cache_direct_chat(key, chat_id)
+                    return {
+                        'statusCode': 200,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'chat_id': chat_id}),
+                        'isBase64Encoded': False
+                    }
+                
+                chat_id = chat[0]
+                cur.execute("""
+                    INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)
+                    ON CONFLICT (chat_id, user_id) DO NOTHING
+                """, (chat_id, key[0], chat_id, key[1]))
                 
                 cur.execute(
                     "INSERT INTO activity_logs (user_id, action, details) VALUES (%s, %s, %s)",
                     (user_id, 'create_chat', f'Создал чат с пользователем {other_user_id}')
                 )
                 conn.commit()
+                cache_direct_chat(key, chat_id)
                 
                 return {
                     'statusCode': 200,
@@ -251,14 +724,90 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             elif action == 'clear_chat':
                 chat_id = body.get('chat_id')
                 
-                cur.execute("UPDATE messages SET text = 'Сообщение удалено' WHERE chat_id = %s AND sender_id = %s",
-                           (chat_id, user_id))
+                cur.execute("SELECT MAX(id) FROM messages WHERE chat_id = %s AND sender_id = %s", (chat_id, user_id))
+                upto = cur.fetchone()[0]
+                seq = None
+                if upto:
+                    seq = append_event(cur, chat_id, EVENT_CLEAR, user_id, upto)
                 conn.commit()
                 
                 return {
                     'statusCode': 200,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True}),
+                    'body': json.dumps({'success': True, 'seq': seq}),
+                    'isBase64Encoded': False
+                }
+            
+            elif action in ('edit_message', 'delete_message', 'react'):
+                message_id = body.get('message_id')
+                required = {'edit_message': 'text', 'react': 'emoji'}.get(action)
+                
+                if required and not (isinstance(body.get(required), str) and body[required].strip()):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': f'{required} is required'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute("""
+                    SELECT m.chat_id, m.sender_id FROM messages m
+                    JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = %s
+                    WHERE m.id = %s
+                """, (user_id, message_id))
+                message = cur.fetchone()
+                if not message:
+                    return {
+                        'statusCode': 404,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Message not found'}),
+                        'isBase64Encoded': False
+                    }
+                
+                if action != 'react' and str(message[1]) != str(user_id):
+                    return {
+                        'statusCode': 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Access denied'}),
+                        'isBase64Encoded': False
+                    }
+                
+                if action == 'edit_message':
+                    seq = append_event(cur, message[0], EVENT_EDIT, user_id, message_id, body['text'])
+                elif action == 'delete_message':
+                    seq = append_event(cur, message[0], EVENT_DELETE, user_id, message_id)
+                else:
+                    kind = EVENT_UNREACT if body.get('remove') else EVENT_REACT
+                    seq = append_event(cur, message[0], kind, user_id, message_id, body.get('emoji'))
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True, 'seq': seq}),
+                    'isBase64Encoded': False
+                }
+            
+            elif action == 'mark_read':
+                chat_id = body.get('chat_id')
+                message_id = body.get('message_id')
+                
+                access = chat_access(cur, chat_id, user_id)
+                if not access:
+                    return {
+                        'statusCode': 404 if access is None else 403,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Chat not found' if access is None else 'Access denied'}),
+                        'isBase64Encoded': False
+                    }
+                
+                seq = append_event(cur, chat_id, EVENT_READ, user_id, message_id)
+                conn.commit()
+                
+                return {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'success': True, 'seq': seq}),
                     'isBase64Encoded': False
                 }
         
@@ -271,4 +820,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
@@ -1,8 +1,38 @@
 import json
 import os
-import psycopg2
+import select
+import time
 from typing import Dict, Any
 
+CONN = None
+CONN_USED_AT = 0.0
+IDLE_CHECK_SECONDS = 30
+
+def get_connection():
+    """
+    Соединение с БД, переиспользуемое тёплыми вызовами функции.
+    Простаивающее соединение не должно получать данных: если сокет читается,
+    сервер или пулер уже закрыл его (перезапуск, таймаут простоя). После простоя
+    дольше IDLE_CHECK_SECONDS соединение дополнительно проверяется запросом SELECT 1.
+    """
+    global CONN, CONN_USED_AT
+    if CONN is not None and not CONN.closed:
+        try:
+            if select.select([CONN], [], [], 0)[0]:
+                raise ConnectionError('connection closed by server')
+            if time.monotonic() - CONN_USED_AT > IDLE_CHECK_SECONDS:
+                cur = CONN.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                CONN.rollback()
+        except Exception:
+            CONN.close()
+    if CONN is None or CONN.closed:
+        import psycopg2
+        CONN = psycopg2.connect(os.environ['DATABASE_URL'])
+    CONN_USED_AT = time.monotonic()
+    return CONN
+
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     """
     Управление профилем пользователя
@@ -22,10 +52,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False
         }
     
-    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn = get_connection()
     cur = conn.cursor()
     
     try:
+        if (event.get('queryStringParameters') or {}).get('action') == 'warmup':
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'warm': True}),
+                'isBase64Encoded': False
+            }
+        
         headers = event.get('headers', {})
         user_id = headers.get('x-user-id') or headers.get('X-User-Id')
         
@@ -61,11 +101,26 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 username = body.get('username')
                 avatar = body.get('avatar')
                 banner = body.get('banner')
+                avatar_attachment_id = body.get('avatar_attachment_id')
+                banner_attachment_id = body.get('banner_attachment_id')
                 
-                cur.execute(
-                    "UPDATE users SET name = %s, username = %s, avatar = COALESCE(%s, avatar), banner = COALESCE(%s, banner) WHERE id = %s",
-                    (name, username, avatar, banner, user_id)
-                )
+                if any(isinstance(v, str) and v.startswith('data:') for v in (avatar, banner)):
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'body': json.dumps({'error': 'Загрузите изображение как вложение и передайте его id'}),
+                        'isBase64Encoded': False
+                    }
+                
+                cur.execute("""
+                    UPDATE users SET name = %s, username = %s,
+                           avatar = COALESCE((SELECT url FROM attachments WHERE id = %s AND user_id = users.id), %s, avatar),
+                           banner = COALESCE((SELECT url FROM attachments WHERE id = %s AND user_id = users.id), %s, banner),
+                           avatar_attachment_id = COALESCE((SELECT id FROM attachments WHERE id = %s AND user_id = users.id), avatar_attachment_id),
+                           banner_attachment_id = COALESCE((SELECT id FROM attachments WHERE id = %s AND user_id = users.id), banner_attachment_id)
+                    WHERE id = %s
+                """, (name, username, avatar_attachment_id, avatar, banner_attachment_id, banner,
+                      avatar_attachment_id, banner_attachment_id, user_id))
                 conn.commit()
                 
                 cur.execute(
@@ -101,8 +156,10 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             elif action == 'set_online_status':
                 is_online = body.get('is_online')
                 
-                cur.execute("UPDATE users SET is_online = %s, last_seen = CURRENT_TIMESTAMP WHERE id = %s",
-                           (is_online, user_id))
+                cur.execute("""
+                    UPDATE users SET is_online = %s, last_seen = CURRENT_TIMESTAMP, last_active_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (is_online, user_id))
                 conn.commit()
                 
                 return {
@@ -121,4 +178,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        try:
+            conn.rollback()
+        except Exception:
+            conn.close()
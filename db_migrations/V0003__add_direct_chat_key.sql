@@ -0,0 +1,19 @@
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS direct_user_low INTEGER REFERENCES users(id);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS direct_user_high INTEGER REFERENCES users(id);
+
+UPDATE chats c
+SET direct_user_low = p.low, direct_user_high = p.high
+FROM (
+    SELECT DISTINCT ON (pairs.low, pairs.high) pairs.chat_id, pairs.low, pairs.high
+    FROM (
+        SELECT cm.chat_id, MIN(cm.user_id) as low, MAX(cm.user_id) as high
+        FROM chat_members cm
+        JOIN chats ch ON ch.id = cm.chat_id AND ch.is_group = false
+        GROUP BY cm.chat_id
+        HAVING COUNT(*) <= 2
+    ) pairs
+    ORDER BY pairs.low, pairs.high, pairs.chat_id
+) p
+WHERE c.id = p.chat_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chats_direct_pair ON chats(direct_user_low, direct_user_high);
@@ -0,0 +1,61 @@
+CREATE TABLE IF NOT EXISTS attachment_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    storage_key TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS attachments (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    sha256 CHAR(64) REFERENCES attachment_blobs(sha256),
+    file_name VARCHAR(255),
+    mime_type VARCHAR(100),
+    size BIGINT NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    duration INTEGER,
+    thumbnail_id INTEGER REFERENCES attachments(id),
+    url TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    id VARCHAR(32) PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    file_name VARCHAR(255),
+    mime_type VARCHAR(100),
+    size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    chunks_total INTEGER NOT NULL,
+    sha256 CHAR(64),
+    width INTEGER,
+    height INTEGER,
+    duration INTEGER,
+    thumbnail_id INTEGER REFERENCES attachments(id),
+    attachment_id INTEGER REFERENCES attachments(id),
+    status VARCHAR(20) DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS upload_chunks (
+    upload_id VARCHAR(32) REFERENCES uploads(id),
+    chunk_index INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (upload_id, chunk_index)
+);
+
+CREATE TABLE IF NOT EXISTS message_attachments (
+    message_id INTEGER REFERENCES messages(id),
+    attachment_id INTEGER REFERENCES attachments(id),
+    position SMALLINT DEFAULT 0,
+    PRIMARY KEY (message_id, attachment_id)
+);
+
+ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_attachment_id INTEGER REFERENCES attachments(id);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS banner_attachment_id INTEGER REFERENCES attachments(id);
+
+CREATE INDEX IF NOT EXISTS idx_attachments_user_id ON attachments(user_id);
+CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments(sha256);
+CREATE INDEX IF NOT EXISTS idx_uploads_user_id ON uploads(user_id);
+CREATE INDEX IF NOT EXISTS idx_message_attachments_attachment_id ON message_attachments(attachment_id);
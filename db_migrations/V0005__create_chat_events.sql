@@ -0,0 +1,15 @@
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS event_seq BIGINT DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS chat_events (
+    chat_id INTEGER REFERENCES chats(id),
+    seq BIGINT NOT NULL,
+    kind SMALLINT NOT NULL,
+    message_id INTEGER REFERENCES messages(id),
+    actor_id INTEGER REFERENCES users(id),
+    payload TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (chat_id, seq)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_events_message_id ON chat_events(message_id) WHERE message_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_chat_events_chat_kind ON chat_events(chat_id, kind, actor_id, seq);
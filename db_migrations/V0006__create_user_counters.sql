@@ -0,0 +1,40 @@
+CREATE TABLE IF NOT EXISTS user_counters (
+    user_id INTEGER PRIMARY KEY REFERENCES users(id),
+    messages_sent INTEGER DEFAULT 0,
+    calls_made INTEGER DEFAULT 0,
+    calls_received INTEGER DEFAULT 0,
+    last_active_at TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS user_activity_daily (
+    user_id INTEGER REFERENCES users(id),
+    day DATE NOT NULL,
+    messages INTEGER DEFAULT 0,
+    calls INTEGER DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+INSERT INTO user_counters (user_id, messages_sent, calls_made, calls_received, last_active_at)
+SELECT u.id,
+       (SELECT COUNT(*) FROM messages WHERE sender_id = u.id),
+       (SELECT COUNT(*) FROM calls WHERE caller_id = u.id),
+       (SELECT COUNT(*) FROM calls WHERE receiver_id = u.id),
+       (SELECT MAX(created_at) FROM activity_logs WHERE user_id = u.id)
+FROM users u
+ON CONFLICT (user_id) DO NOTHING;
+
+INSERT INTO user_activity_daily (user_id, day, messages, calls)
+SELECT user_id, day, SUM(messages), SUM(calls)
+FROM (
+    SELECT sender_id as user_id, created_at::date as day, COUNT(*) as messages, 0 as calls
+    FROM messages GROUP BY sender_id, created_at::date
+    UNION ALL
+    SELECT caller_id, created_at::date, 0, COUNT(*) FROM calls GROUP BY caller_id, created_at::date
+    UNION ALL
+    SELECT receiver_id, created_at::date, 0, COUNT(*) FROM calls GROUP BY receiver_id, created_at::date
+) activity
+WHERE user_id IS NOT NULL
+GROUP BY user_id, day
+ON CONFLICT (user_id, day) DO NOTHING;
+
+CREATE INDEX IF NOT EXISTS idx_activity_logs_user_id_id ON activity_logs(user_id, id DESC);
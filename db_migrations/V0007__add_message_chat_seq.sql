@@ -0,0 +1,18 @@
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_seq BIGINT DEFAULT 0;
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS chat_seq BIGINT;
+
+UPDATE messages m
+SET chat_seq = s.seq
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY created_at, id) as seq
+    FROM messages
+) s
+WHERE m.id = s.id;
+
+UPDATE chats c
+SET last_message_seq = COALESCE((SELECT MAX(chat_seq) FROM messages WHERE chat_id = c.id), 0);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_chat_seq ON messages(chat_id, chat_seq);
+
+DROP INDEX IF EXISTS idx_messages_created_at;
+DROP INDEX IF EXISTS idx_messages_chat_id;
@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS job_runs (
+    id SERIAL PRIMARY KEY,
+    job VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    rows_affected INTEGER DEFAULT 0,
+    chunks INTEGER DEFAULT 0,
+    duration_ms INTEGER DEFAULT 0,
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, id DESC);
+CREATE INDEX IF NOT EXISTS idx_calls_ringing ON calls(created_at) WHERE status = 'ringing';
+CREATE INDEX IF NOT EXISTS idx_activity_logs_created_at ON activity_logs(created_at);
+CREATE INDEX IF NOT EXISTS idx_users_online ON users(last_seen) WHERE is_online = true;
@@ -0,0 +1,16 @@
+UPDATE messages m
+SET chat_seq = s.seq
+FROM (
+    SELECT n.id,
+           COALESCE((SELECT MAX(chat_seq) FROM messages WHERE chat_id = n.chat_id), 0)
+           + ROW_NUMBER() OVER (PARTITION BY n.chat_id ORDER BY n.created_at, n.id) as seq
+    FROM messages n
+    WHERE n.chat_seq IS NULL
+) s
+WHERE m.id = s.id;
+
+UPDATE chats c
+SET last_message_seq = GREATEST(c.last_message_seq, (SELECT MAX(chat_seq) FROM messages WHERE chat_id = c.id))
+WHERE EXISTS (SELECT 1 FROM messages WHERE chat_id = c.id);
+
+ALTER TABLE messages ALTER COLUMN chat_seq SET NOT NULL;
@@ -0,0 +1,9 @@
+ALTER TABLE users ADD COLUMN IF NOT EXISTS last_active_at TIMESTAMP;
+UPDATE users SET last_active_at = last_seen WHERE last_active_at IS NULL;
+
+DROP INDEX IF EXISTS idx_users_online;
+CREATE INDEX IF NOT EXISTS idx_users_online_active ON users(last_active_at) WHERE is_online = true;
+
+ALTER TABLE user_counters ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_user_counters_refreshed_at ON user_counters(refreshed_at NULLS FIRST);
+CREATE INDEX IF NOT EXISTS idx_messages_sender_id ON messages(sender_id);
@@ -0,0 +1,7 @@
+UPDATE users u
+SET last_active_at = c.last_active_at
+FROM user_counters c
+WHERE c.user_id = u.id AND c.last_active_at IS NOT NULL
+  AND (u.last_active_at IS NULL OR u.last_active_at < c.last_active_at);
+
+ALTER TABLE user_counters DROP COLUMN IF EXISTS last_active_at;